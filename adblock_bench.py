@@ -0,0 +1,430 @@
+"""Replay a recorded request corpus through the ad blocker's decision path.
+
+Usage:
+    python adblock_bench.py --list easylist.txt --list tracker:easyprivacy.txt \
+        --corpus requests.txt [--matchers trie,engine,cached,snapshot,blocker,chain,linear]
+        [--repeat 3] [--workers N] [--no-policy] [--json results.json] [--baseline old.json --tolerance 0.15]
+
+Each corpus line is ``url [first_party_url] [resource_type]``. The first
+party may be ``-`` when there is none, and the resource type is either a
+QWebEngineUrlRequestInfo number or a name such as ``script`` or ``image``.
+Lines starting with ``#`` are ignored. Before anything is timed, a few rule
+sets with known verdicts (KNOWN_ANSWERS) are checked, and a wrong one fails
+the run.
+
+No browser is started. The trie, engine, cached and snapshot matchers only
+need filter_engine.py, so they run without PyQt5 or QtWebEngine; so does
+``linear``, the original host scan, which is slow on full lists and only
+runs when asked for. ``blocker`` and ``chain`` feed stub request infos to
+the real AdBlocker (behind the InterceptorChain for ``chain``), built on the
+``--list`` files rather than the user's subscriptions, and need QtWebEngine
+installed. With ``--baseline`` the exit status is non-zero when a matcher got
+slower than the baseline by more than the tolerance, which is what CI checks.
+
+The AdBlocker matchers run with the default InterceptPolicy unless
+``--no-policy`` is given; the ``skip`` column is the share of requests the
+policy kept away from the full matcher.
+
+Memory is the process's resident set: ``build MB`` is what it grew by while
+the matcher was built (mmap'd snapshot pages included once touched) and
+``replay MB`` what it grew by during the replay. The peak resident set of
+the whole run, and of the largest compile worker, is printed at the end.
+"""
+import argparse
+import gc
+import json
+import mmap
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+import filter_engine
+
+# QWebEngineUrlRequestInfo.NavigationTypeOther
+NAVIGATION_TYPE_OTHER = 5
+
+
+def browser_module(matcher_name):
+    """Import main.py, which the AdBlocker based matchers need."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        import main
+    except ImportError as e:
+        raise SystemExit(f"the {matcher_name} matcher needs PyQt5 with QtWebEngine: {e}")
+    return main
+
+
+class StubUrl:
+    """The QUrl methods the interceptors call, without needing Qt."""
+    def __init__(self, url):
+        self.url = url
+        parts = urlsplit(url)
+        self.scheme_name = parts.scheme
+        self.host_name = parts.hostname or ''
+
+    def toString(self):
+        return self.url
+
+    def scheme(self):
+        return self.scheme_name
+
+    def host(self):
+        return self.host_name
+
+
+class StubRequestInfo:
+    """Just enough of QWebEngineUrlRequestInfo for the interceptors."""
+    def __init__(self, url, first_party_url, resource_type,
+                 navigation_type=NAVIGATION_TYPE_OTHER):
+        self.url = StubUrl(url)
+        self.first_party_url = StubUrl(first_party_url)
+        self.resource_type = resource_type
+        self.navigation_type = navigation_type
+        self.blocked = False
+        self.redirected_to = None
+        self.headers = {}
+
+    def requestUrl(self):
+        return self.url
+
+    def firstPartyUrl(self):
+        return self.first_party_url
+
+    def resourceType(self):
+        return self.resource_type
+
+    def navigationType(self):
+        return self.navigation_type
+
+    def requestMethod(self):
+        return b"GET"
+
+    def block(self, should_block):
+        self.blocked = should_block
+
+    def redirect(self, url):
+        self.redirected_to = url
+
+    def setHttpHeader(self, name, value):
+        self.headers[bytes(name)] = bytes(value)
+
+
+class LinearHostMatcher:
+    """The original set + endswith() scan, kept as the reference point."""
+    def __init__(self, engine):
+        self.ad_hosts = set(engine.host_names(filter_engine.AD_LIST))
+        self.tracker_hosts = set(engine.host_names(filter_engine.TRACKER_LIST))
+
+    def interceptRequest(self, info):
+        host = info.requestUrl().host()
+        for hosts in (self.ad_hosts, self.tracker_hosts):
+            if host in hosts or any(host.endswith('.' + h) for h in hosts):
+                info.block(True)
+                return
+
+
+class TrieHostMatcher:
+    """Plain host rules only, looked up in a DomainTrie."""
+    def __init__(self, engine):
+        self.hosts = filter_engine.DomainTrie()
+        for host, lists in engine.host_entries():
+            self.hosts.add(host, lists)
+
+    def interceptRequest(self, info):
+        if self.hosts.match(info.requestUrl().host()):
+            info.block(True)
+
+
+class EngineMatcher:
+    """FilterEngine.match() on every request, as AdBlocker calls it."""
+    def __init__(self, engine):
+        self.engine = engine
+
+    def interceptRequest(self, info):
+        url = info.requestUrl()
+        type_bit = filter_engine.RESOURCE_TYPE_BITS.get(info.resourceType(),
+                                                        filter_engine.TYPE_OTHER)
+        if self.engine.match(url.toString(), url.host(), info.firstPartyUrl().host(), type_bit):
+            info.block(True)
+
+
+# (rules, url, first party url, resource type, blocked?) with known answers,
+# checked before every run so a wrong verdict fails CI even when the corpus
+# never hits the rules involved
+KNOWN_ANSWERS = [
+    (['||example.com/ads/*$important', '@@||example.com^'],
+     'https://example.com/ads/a.js', 'https://news.com/', 'script', True),
+    (['||example.com/ads/*$important', '@@||example.com^'],
+     'https://example.com/app.js', 'https://news.com/', 'script', False),
+    (['||cdn.net/ads/*$important', '@@||news.com^$document'],
+     'https://cdn.net/ads/a.js', 'https://news.com/', 'script', True),
+    (['||cdn.net/ads/*', '@@||news.com^$document'],
+     'https://cdn.net/ads/a.js', 'https://news.com/', 'script', False),
+    (['/banner\\d+/$image'], 'https://x.com/banner12', 'https://y.com/', 'image', True),
+    (['/banner\\d+/$image'], 'https://x.com/banner12', 'https://y.com/', 'script', False),
+]
+
+
+def check_known_answers():
+    failures = []
+    for rules, url, first_party, resource_type, blocked in KNOWN_ANSWERS:
+        engine = filter_engine.FilterEngine()
+        engine.add_filters(filter_engine.parse_filter(rule, filter_engine.AD_LIST)
+                           for rule in rules)
+        info = StubRequestInfo(url, first_party, parse_resource_type(resource_type))
+        EngineMatcher(engine).interceptRequest(info)
+        if info.blocked != blocked:
+            failures.append(f"{' + '.join(rules)}: {url} ({resource_type}) "
+                            f"{'blocked' if info.blocked else 'allowed'}")
+    return failures
+
+
+def parse_resource_type(value):
+    if value.isdigit():
+        return int(value)
+    aliases = {"font": "font_resource", "document": "main_frame",
+               "subdocument": "sub_frame", "xmlhttprequest": "xhr"}
+    name = value.lower()
+    name = aliases.get(name, name)
+    return filter_engine.RESOURCE_TYPES.get(name, filter_engine.RESOURCE_TYPES['unknown'])
+
+
+def load_corpus(path):
+    requests = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            first_party = fields[1] if len(fields) > 1 and fields[1] != '-' else ''
+            resource_type = (parse_resource_type(fields[2]) if len(fields) > 2
+                             else filter_engine.RESOURCE_TYPES['sub_resource'])
+            requests.append((fields[0], first_party, resource_type))
+    return requests
+
+
+def list_files(list_args):
+    """Yield (list flag, path) for each --list argument."""
+    for arg in list_args:
+        lists = filter_engine.AD_LIST
+        if ':' in arg and not os.path.exists(arg):
+            name, arg = arg.split(':', 1)
+            lists = {'ad': filter_engine.AD_LIST, 'tracker': filter_engine.TRACKER_LIST}[name]
+        yield lists, arg
+
+
+def read_lists(list_args):
+    texts = {}
+    for lists, path in list_files(list_args):
+        with open(path, 'r', encoding='utf-8') as f:
+            texts[lists] = texts.get(lists, '') + f.read() + '\n'
+    return texts
+
+
+def compile_lists(list_args, verdict_cache_size=filter_engine.VERDICT_CACHE_SIZE, workers=1):
+    compiled = filter_engine.compile_filter_lists(read_lists(list_args), workers)
+    engine = filter_engine.FilterEngine(verdict_cache_size)
+    engine.add_compiled(chunk for chunks in compiled.values() for chunk in chunks)
+    return engine
+
+
+def build_matcher(name, list_args, workdir, workers=1, use_policy=True):
+    if name == 'linear':
+        return LinearHostMatcher(compile_lists(list_args, workers=workers))
+    if name == 'trie':
+        return TrieHostMatcher(compile_lists(list_args, workers=workers))
+    if name == 'engine':
+        # no verdict cache, so every request walks the full matcher
+        return EngineMatcher(compile_lists(list_args, 0, workers))
+    if name == 'cached':
+        return EngineMatcher(compile_lists(list_args, workers=workers))
+    if name == 'snapshot':
+        # the engine as the browser loads it on start: hosts served from the
+        # mmap'd snapshot file
+        engine = compile_lists(list_args, workers=workers)
+        path = os.path.join(workdir, "snapshot.bin")
+        filter_engine.write_snapshot(path, engine.host_entries(), engine.rule_entries(),
+                                     time.time())
+        del engine
+        return EngineMatcher(filter_engine.FilterEngine.from_snapshot(
+            filter_engine.HostSnapshot(path)))
+    if name not in ('blocker', 'chain'):
+        raise SystemExit(f"unknown matcher: {name}")
+    main = browser_module(name)
+    policy = main.InterceptPolicy() if use_policy else main.InterceptPolicy(False, False)
+    # explicit lists, so the user's subscriptions are never read
+    filter_lists = {lists: path for lists, path in list_files(list_args)}
+    blocker = main.AdBlocker(filter_lists=filter_lists,
+                             cache_file=os.path.join(workdir, f"{name}.bin"),
+                             auto_refresh=False, policy=policy)
+    blocker.set_engine(compile_lists(list_args, workers=workers))
+    if name == 'blocker':
+        return blocker
+    # the blocker behind the InterceptorChain the browser installs, to show
+    # what the dispatch and per-stage timing cost
+    chain = main.InterceptorChain()
+    chain.add_stage(blocker)
+    return chain
+
+
+def rss_bytes():
+    """The resident set size now, or its high-water mark off Linux."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes(children=False):
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # bytes on macOS, kilobytes everywhere else
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def build_matchers(names, list_args, workdir, workers=1, use_policy=True):
+    """Return {name: (interceptor, compile seconds, resident bytes added)}."""
+    matchers = {}
+    for name in names:
+        if name in ('blocker', 'chain'):
+            # so loading Qt doesn't count towards the first matcher's build
+            browser_module(name)
+        gc.collect()
+        rss = rss_bytes()
+        start = time.perf_counter()
+        matcher = build_matcher(name, list_args, workdir, workers, use_policy)
+        elapsed = time.perf_counter() - start
+        matchers[name] = (matcher, elapsed, max(0, rss_bytes() - rss))
+    return matchers
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def replay(matcher, infos, repeat):
+    intercept = matcher.interceptRequest
+    clock = time.perf_counter_ns
+    # one untimed pass builds lazily compiled regexes and warms caches
+    for info in infos:
+        intercept(info)
+    samples = []
+    blocked = 0
+    for _ in range(repeat):
+        for info in infos:
+            info.blocked = False
+            start = clock()
+            intercept(info)
+            samples.append(clock() - start)
+        blocked = sum(1 for info in infos if info.blocked)
+    samples.sort()
+    return {
+        'requests': len(infos),
+        'ns_per_decision': sum(samples) / len(samples) if samples else 0,
+        'p50_ns': percentile(samples, 0.50),
+        'p99_ns': percentile(samples, 0.99),
+        'match_rate': blocked / len(infos) if infos else 0.0,
+    }
+
+
+def check_baseline(results, baseline_path, tolerance):
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    failures = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        limit = previous['ns_per_decision'] * (1 + tolerance)
+        if result['ns_per_decision'] > limit:
+            failures.append(f"{name}: {result['ns_per_decision']:.0f} ns/decision, "
+                            f"baseline {previous['ns_per_decision']:.0f} ns")
+        if abs(result['match_rate'] - previous['match_rate']) > 1e-9:
+            failures.append(f"{name}: match rate {result['match_rate']:.4f}, "
+                            f"baseline {previous['match_rate']:.4f}")
+    return failures
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--list', action='append', required=True,
+                        help="filter list file, optionally prefixed with ad: or tracker:")
+    parser.add_argument('--corpus', required=True, help="recorded request corpus")
+    parser.add_argument('--matchers', default='trie,engine,cached,snapshot',
+                        help="comma separated; linear is left out unless named")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes used to parse the lists (0 = one per core, up to 4)")
+    parser.add_argument('--no-policy', action='store_true',
+                        help="run every request through the full matcher")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file from an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="allowed slowdown against the baseline (0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    failures = check_known_answers()
+    for failure in failures:
+        print(f"WRONG VERDICT {failure}")
+    if failures:
+        return 1
+
+    corpus = load_corpus(args.corpus)
+    names = [name.strip() for name in args.matchers.split(',') if name.strip()]
+    results = {}
+    infos = [StubRequestInfo(*request) for request in corpus]
+    with tempfile.TemporaryDirectory() as workdir:
+        matchers = build_matchers(names, args.list, workdir, args.workers, not args.no_policy)
+        for name, (matcher, compile_seconds, build_bytes) in matchers.items():
+            gc.collect()
+            rss = rss_bytes()
+            result = replay(matcher, infos, args.repeat)
+            result['replay_mb'] = max(0, rss_bytes() - rss) / (1024 * 1024)
+            result['compile_ms'] = compile_seconds * 1000
+            result['build_mb'] = build_bytes / (1024 * 1024)
+            if hasattr(matcher, 'verdict_cache_stats'):
+                result['verdict_cache'] = matcher.verdict_cache_stats()
+                result['skip_share'] = matcher.stats.snapshot()['skipped_share']
+            elif hasattr(matcher, 'stage_stats'):
+                result['stages'] = matcher.stage_stats()
+                result['skip_share'] = matcher.stage('adblock').stats.snapshot()['skipped_share']
+            results[name] = result
+
+    print(f"{len(corpus)} requests x {args.repeat}")
+    print(f"{'matcher':<10}{'ns/dec':>10}{'p50':>9}{'p99':>10}{'match':>8}"
+          f"{'skip':>8}{'compile ms':>12}{'build MB':>10}{'replay MB':>11}")
+    for name, result in results.items():
+        print(f"{name:<10}{result['ns_per_decision']:>10.0f}{result['p50_ns']:>9}"
+              f"{result['p99_ns']:>10}{result['match_rate']:>8.2%}"
+              f"{result.get('skip_share', 0.0):>8.1%}"
+              f"{result['compile_ms']:>12.1f}{result['build_mb']:>10.1f}"
+              f"{result['replay_mb']:>11.1f}")
+    print(f"peak resident: {peak_rss_bytes() / (1024 * 1024):.1f} MB, "
+          f"largest child process (compile worker) {peak_rss_bytes(children=True) / (1024 * 1024):.1f} MB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        failures = check_baseline(results, args.baseline, args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
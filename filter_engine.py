@@ -0,0 +1,1125 @@
+"""Network and cosmetic filter engine used by the ad blocker.
+
+Nothing in here imports Qt, so the filter list compile pool's workers and
+adblock_bench.py can load it without PyQt5 or QtWebEngine.
+"""
+import importlib.machinery
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import lru_cache
+
+# bit flags recording which filter list a host came from
+AD_LIST = 1
+TRACKER_LIST = 2
+
+class DomainTrieNode:
+    __slots__ = ('children', 'lists', 'rules')
+
+    def __init__(self):
+        self.children = {}
+        self.lists = 0
+        self.rules = None
+
+class DomainTrie:
+    """Reversed-label index of blocked hosts, walked from the TLD inwards."""
+    def __init__(self):
+        self.root = DomainTrieNode()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def node(self, host):
+        node = self.root
+        for label in reversed(host.lower().split('.')):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = DomainTrieNode()
+            node = child
+        return node
+
+    def add(self, host, list_flag):
+        node = self.node(host)
+        if not node.lists:
+            self.size += 1
+        node.lists |= list_flag
+
+    def discard(self, host, list_flag):
+        node = self.root
+        for label in reversed(host.lower().split('.')):
+            node = node.children.get(label)
+            if node is None:
+                return
+        if node.lists & list_flag:
+            node.lists &= ~list_flag
+            if not node.lists:
+                self.size -= 1
+
+    def update(self, hosts, list_flag):
+        for host in hosts:
+            self.add(host, list_flag)
+
+    def match(self, host):
+        # a listed domain also covers all of its subdomains, so collect the
+        # flags of every listed suffix along the way down
+        lists = 0
+        node = self.root
+        for label in reversed(host.lower().split('.')):
+            node = node.children.get(label)
+            if node is None:
+                break
+            lists |= node.lists
+        return lists
+
+    def walk(self, host):
+        # like match(), but also hands back the option-carrying host rules
+        # attached to every listed suffix
+        lists = 0
+        rules = []
+        node = self.root
+        for label in reversed(host.split('.')):
+            node = node.children.get(label)
+            if node is None:
+                break
+            lists |= node.lists
+            if node.rules:
+                rules.extend(node.rules)
+        return lists, rules
+
+    def entries(self):
+        stack = [(self.root, [])]
+        while stack:
+            node, labels = stack.pop()
+            if node.lists:
+                yield '.'.join(reversed(labels)), node.lists
+            for label, child in node.children.items():
+                stack.append((child, labels + [label]))
+
+    def hosts(self, list_flag):
+        for host, lists in self.entries():
+            if lists & list_flag:
+                yield host
+
+SNAPSHOT_MAGIC = b'PBFS'
+SNAPSHOT_VERSION = 1
+# magic, version, reserved, last updated (unix time), host count, hash slot
+# count, rules size, crc32
+SNAPSHOT_HEADER = struct.Struct('<4sHHdIIII')
+SNAPSHOT_SPAN = struct.Struct('<II')
+SNAPSHOT_MASK = struct.Struct('<I')
+
+class SnapshotError(Exception):
+    pass
+
+class HostSnapshot:
+    """Read-only host index served straight from an mmap'd snapshot file.
+
+    The file holds the reversed-label host names (``com.doubleclick``) in
+    sorted order behind an offset table, plus an open-addressing hash table
+    of entry numbers so each suffix of a request host costs one or two probes
+    into the mapped bytes instead of rebuilding Python sets on every launch.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < SNAPSHOT_HEADER.size:
+            raise SnapshotError("snapshot is truncated")
+        (magic, version, _, self.last_updated, self.count, self.slot_count,
+         rules_size, checksum) = SNAPSHOT_HEADER.unpack_from(self.mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise SnapshotError("not a PyBrowse filter snapshot")
+        if zlib.crc32(memoryview(self.mm)[SNAPSHOT_HEADER.size:]) != checksum:
+            raise SnapshotError("snapshot checksum mismatch")
+        self.offsets_pos = SNAPSHOT_HEADER.size
+        self.masks_pos = self.offsets_pos + 4 * (self.count + 1)
+        self.slots_pos = self.masks_pos + 4 * self.count
+        self.names_pos = self.slots_pos + 4 * self.slot_count
+        names_size = SNAPSHOT_MASK.unpack_from(self.mm, self.masks_pos - 4)[0]
+        self.slot_mask = self.slot_count - 1
+        self.rules_pos = self.names_pos + names_size
+        self.rules_size = rules_size
+
+    def __len__(self):
+        return self.count
+
+    def name(self, index):
+        start, end = SNAPSHOT_SPAN.unpack_from(self.mm, self.offsets_pos + 4 * index)
+        return self.mm[self.names_pos + start:self.names_pos + end]
+
+    def mask(self, index):
+        return SNAPSHOT_MASK.unpack_from(self.mm, self.masks_pos + 4 * index)[0]
+
+    def find(self, key):
+        if not self.slot_count:
+            return -1
+        slot = zlib.crc32(key) & self.slot_mask
+        while True:
+            entry = SNAPSHOT_MASK.unpack_from(self.mm, self.slots_pos + 4 * slot)[0]
+            if not entry:
+                return -1
+            if self.name(entry - 1) == key:
+                return entry - 1
+            slot = (slot + 1) & self.slot_mask
+
+    def match(self, host, removed=None):
+        # removed maps host -> list flags withdrawn since the snapshot was
+        # written, see FilterEngine.remove_filter
+        lists = 0
+        key = b''
+        labels = host.split('.')
+        for i in range(len(labels) - 1, -1, -1):
+            label = labels[i].encode('ascii', 'ignore')
+            key = key + b'.' + label if key else label
+            index = self.find(key)
+            if index != -1:
+                mask = self.mask(index)
+                if removed:
+                    mask &= ~removed.get('.'.join(labels[i:]), 0)
+                lists |= mask
+        return lists
+
+    def entries(self):
+        for index in range(self.count):
+            labels = self.name(index).decode('ascii').split('.')
+            yield '.'.join(reversed(labels)), self.mask(index)
+
+    def rule_lines(self):
+        rules = self.mm[self.rules_pos:self.rules_pos + self.rules_size].decode('utf-8')
+        for line in rules.splitlines():
+            lists, token, text = line.split('\t', 2)
+            yield int(lists), token, text
+
+    def close(self):
+        self.mm.close()
+
+def write_snapshot(path, host_entries, rule_entries, last_updated):
+    names = sorted(
+        ('.'.join(reversed(host.split('.'))).encode('ascii', 'ignore'), lists)
+        for host, lists in host_entries
+    )
+    offsets = bytearray()
+    masks = bytearray()
+    blob = bytearray()
+    for name, lists in names:
+        offsets += SNAPSHOT_MASK.pack(len(blob))
+        masks += SNAPSHOT_MASK.pack(lists)
+        blob += name
+    offsets += SNAPSHOT_MASK.pack(len(blob))
+    # power-of-two table at most half full, so probe runs stay short
+    slot_count = 1
+    while slot_count < 2 * len(names):
+        slot_count *= 2
+    slots = [0] * slot_count
+    for index, (name, _) in enumerate(names):
+        slot = zlib.crc32(name) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = index + 1
+    slot_table = struct.pack(f'<{slot_count}I', *slots)
+    rules = '\n'.join(f"{lists}\t{token}\t{text}"
+                      for lists, token, text in rule_entries).encode('utf-8')
+    body = bytes(offsets) + bytes(masks) + slot_table + bytes(blob) + rules
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, last_updated,
+                                  len(names), slot_count, len(rules), zlib.crc32(body))
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+
+# resource type categories used by filter options such as $script or $image
+TYPE_DOCUMENT = 1
+TYPE_SUBDOCUMENT = 2
+TYPE_SCRIPT = 4
+TYPE_IMAGE = 8
+TYPE_STYLESHEET = 16
+TYPE_OBJECT = 32
+TYPE_XMLHTTPREQUEST = 64
+TYPE_PING = 128
+TYPE_MEDIA = 256
+TYPE_FONT = 512
+TYPE_OTHER = 1024
+ALL_TYPES = 2047
+
+# QWebEngineUrlRequestInfo.ResourceType values, spelled out so the engine and
+# adblock_bench.py can map request types without importing QtWebEngine
+RESOURCE_TYPES = {
+    'main_frame': 0,
+    'sub_frame': 1,
+    'stylesheet': 2,
+    'script': 3,
+    'image': 4,
+    'font_resource': 5,
+    'sub_resource': 6,
+    'object': 7,
+    'media': 8,
+    'worker': 9,
+    'shared_worker': 10,
+    'prefetch': 11,
+    'favicon': 12,
+    'xhr': 13,
+    'ping': 14,
+    'service_worker': 15,
+    'csp_report': 16,
+    'plugin_resource': 17,
+    'navigation_preload_main_frame': 19,
+    'navigation_preload_sub_frame': 20,
+    'unknown': 255,
+}
+
+RESOURCE_TYPE_BITS = {
+    RESOURCE_TYPES['main_frame']: TYPE_DOCUMENT,
+    RESOURCE_TYPES['sub_frame']: TYPE_SUBDOCUMENT,
+    RESOURCE_TYPES['script']: TYPE_SCRIPT,
+    RESOURCE_TYPES['image']: TYPE_IMAGE,
+    RESOURCE_TYPES['favicon']: TYPE_IMAGE,
+    RESOURCE_TYPES['stylesheet']: TYPE_STYLESHEET,
+    RESOURCE_TYPES['object']: TYPE_OBJECT,
+    RESOURCE_TYPES['plugin_resource']: TYPE_OBJECT,
+    RESOURCE_TYPES['xhr']: TYPE_XMLHTTPREQUEST,
+    RESOURCE_TYPES['ping']: TYPE_PING,
+    RESOURCE_TYPES['csp_report']: TYPE_PING,
+    RESOURCE_TYPES['media']: TYPE_MEDIA,
+    RESOURCE_TYPES['font_resource']: TYPE_FONT,
+}
+
+FILTER_TYPE_OPTIONS = {
+    'document': TYPE_DOCUMENT,
+    'doc': TYPE_DOCUMENT,
+    'subdocument': TYPE_SUBDOCUMENT,
+    'frame': TYPE_SUBDOCUMENT,
+    'script': TYPE_SCRIPT,
+    'image': TYPE_IMAGE,
+    'stylesheet': TYPE_STYLESHEET,
+    'css': TYPE_STYLESHEET,
+    'object': TYPE_OBJECT,
+    'object-subrequest': TYPE_OBJECT,
+    'xmlhttprequest': TYPE_XMLHTTPREQUEST,
+    'xhr': TYPE_XMLHTTPREQUEST,
+    'ping': TYPE_PING,
+    'beacon': TYPE_PING,
+    'media': TYPE_MEDIA,
+    'font': TYPE_FONT,
+    'other': TYPE_OTHER,
+}
+
+# options we can't honour from inside a request interceptor; rules using them
+# are dropped rather than applied too broadly
+UNSUPPORTED_FILTER_OPTIONS = {
+    'popup', 'popunder', 'csp', 'redirect', 'redirect-rule', 'removeparam',
+    'rewrite', 'replace', 'header', 'permissions', 'badfilter', 'webrtc',
+    'websocket', 'elemhide', 'ehide', 'generichide', 'ghide', 'specifichide',
+    'shide', 'genericblock', 'denyallow', 'to', 'strict1p', 'strict3p',
+    'empty', 'mp4', 'inline-script', 'inline-font', 'cname', 'method',
+}
+
+FILTER_TOKEN_RE = re.compile(r'[a-z0-9%]+')
+PLAIN_HOST_FILTER_RE = re.compile(r'^\|\|([a-z0-9_-]+(?:\.[a-z0-9_-]+)+)\^?$')
+# the host a ||host/path pattern is anchored to
+ANCHORED_HOST_RE = re.compile(r'^\|\|([a-z0-9_-]+(?:\.[a-z0-9_-]+)+)[/^:?]')
+# tokens that appear in almost every URL make poor bucket keys
+COMMON_URL_TOKENS = {'http', 'https', 'www', 'com', 'net', 'org', 'js', 'html', 'php'}
+
+def site_of(host):
+    # cheap registrable-domain guess, good enough to tell first- from
+    # third-party requests without shipping the public suffix list
+    labels = host.split('.')
+    if len(labels) > 2 and len(labels[-2]) <= 3 and len(labels[-1]) == 2:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+def filter_pattern_to_regex(pattern):
+    regex = ''
+    if pattern.startswith('||'):
+        regex = r'^[a-z][a-z0-9.+-]*:(?://)?(?:[^/?#]*\.)?'
+        pattern = pattern[2:]
+    elif pattern.startswith('|'):
+        regex = '^'
+        pattern = pattern[1:]
+    end = ''
+    if pattern.endswith('|'):
+        end = '$'
+        pattern = pattern[:-1]
+    parts = []
+    for ch in pattern.strip('*'):
+        if ch == '*':
+            parts.append('.*')
+        elif ch == '^':
+            parts.append(r'(?:[^\w.%-]|$)')
+        else:
+            parts.append(re.escape(ch))
+    return regex + ''.join(parts) + end
+
+def filter_pattern_tokens(pattern):
+    # tokens that any URL matching the pattern is guaranteed to contain;
+    # a token touching a wildcard or an unanchored edge could be longer in
+    # the URL, so it can't be used as a bucket key
+    start_anchored = pattern.startswith('|')
+    end_anchored = pattern.endswith('|')
+    pattern = pattern.lstrip('|').rstrip('|')
+    tokens = []
+    for match in FILTER_TOKEN_RE.finditer(pattern.lower()):
+        start, end = match.span()
+        if end - start < 2:
+            continue
+        if start == 0 and not start_anchored:
+            continue
+        if end == len(pattern) and not end_anchored:
+            continue
+        if start > 0 and pattern[start - 1] == '*':
+            continue
+        if end < len(pattern) and pattern[end] == '*':
+            continue
+        tokens.append(match.group())
+    return tokens
+
+class NetworkFilter:
+    __slots__ = ('text', 'lists', 'exception', 'important', 'host', 'pattern',
+                 'regex_source', 'regex', 'match_case', 'types', 'third_party',
+                 'include_domains', 'exclude_domains', 'token')
+
+    def __init__(self, text, lists):
+        self.text = text
+        self.lists = lists
+        self.exception = False
+        self.important = False
+        self.host = None
+        self.pattern = ''
+        self.regex_source = None
+        self.regex = None
+        self.match_case = False
+        self.types = ALL_TYPES & ~TYPE_DOCUMENT
+        self.third_party = None
+        self.include_domains = None
+        self.exclude_domains = None
+        self.token = None
+
+    def __getstate__(self):
+        # a flat tuple pickles far faster than the per-slot state mapping, and
+        # the regex is rebuilt lazily on the other side
+        return tuple(None if name == 'regex' else getattr(self, name)
+                     for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def is_plain_host(self):
+        return (self.host is not None and not self.exception and not self.important
+                and self.third_party is None and self.include_domains is None
+                and self.exclude_domains is None
+                and self.types == ALL_TYPES & ~TYPE_DOCUMENT)
+
+    def applies(self, type_bit, first_party_host, third_party):
+        if not self.types & type_bit:
+            return False
+        if self.third_party is not None and self.third_party != third_party:
+            return False
+        if self.include_domains is not None or self.exclude_domains is not None:
+            labels = first_party_host.split('.')
+            suffixes = ['.'.join(labels[i:]) for i in range(len(labels))]
+            if self.exclude_domains and any(s in self.exclude_domains for s in suffixes):
+                return False
+            if self.include_domains and not any(s in self.include_domains for s in suffixes):
+                return False
+        return True
+
+    def matches(self, url, url_lower):
+        if self.regex is None:
+            # most rules never see a URL that shares their token, so the
+            # regex is only built on first use
+            if self.regex_source is None:
+                self.regex_source = filter_pattern_to_regex(self.pattern)
+            flags = 0 if self.match_case else re.IGNORECASE
+            self.regex = re.compile(self.regex_source, flags)
+        return self.regex.search(url if self.match_case else url_lower) is not None
+
+def parse_filter(line, lists):
+    """Parse one network filter line, or return None for anything we skip."""
+    line = line.strip()
+    if not line or line.startswith(('!', '[')):
+        return None
+    if '#?#' in line or '#$#' in line or '#@?#' in line or '#@$#' in line:
+        return None
+    if '##' in line or '#@#' in line:
+        return parse_cosmetic_filter(line, lists)
+    rule = NetworkFilter(line, lists)
+    if line.startswith('@@'):
+        rule.exception = True
+        line = line[2:]
+    options = None
+    # a rule ending in / is a bare regex, which may itself contain $;
+    # anything else has its options split off before looking for /.../
+    if not (line.startswith('/') and line.endswith('/')):
+        dollar = line.rfind('$')
+        if dollar != -1:
+            options = line[dollar + 1:]
+            line = line[:dollar]
+    is_regex = line.startswith('/') and line.endswith('/') and len(line) > 2
+    if not line:
+        return None
+    if options is not None and not apply_filter_options(rule, options):
+        return None
+    if is_regex:
+        rule.regex_source = line[1:-1]
+        return rule
+    pattern = line if rule.match_case else line.lower()
+    host = PLAIN_HOST_FILTER_RE.match(pattern.lower())
+    if host:
+        rule.host = host.group(1)
+    rule.pattern = pattern
+    return rule
+
+# extended selectors and scriptlets that CSS can't express
+PROCEDURAL_SELECTOR_MARKERS = (
+    ':-abp-', ':has-text(', ':contains(', ':xpath(', ':matches-css', ':matches-path(',
+    ':upward(', ':remove(', ':style(', ':watch-attr(', ':min-text-length(',
+    ':nth-ancestor(', ':others(', '+js(',
+)
+
+class CosmeticFilter:
+    """An element hiding (``##``) or unhiding (``#@#``) rule."""
+    __slots__ = ('text', 'lists', 'exception', 'selector', 'include_domains',
+                 'exclude_domains', 'token')
+
+    def __init__(self, text, lists):
+        self.text = text
+        self.lists = lists
+        self.exception = False
+        self.selector = ''
+        self.include_domains = None
+        self.exclude_domains = None
+        self.token = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def is_plain_host(self):
+        return False
+
+def parse_cosmetic_filter(line, lists):
+    rule = CosmeticFilter(line, lists)
+    separator = '#@#' if '#@#' in line else '##'
+    rule.exception = separator == '#@#'
+    domains, selector = line.split(separator, 1)
+    selector = selector.strip()
+    if (not selector or '{' in selector or '}' in selector
+            or any(marker in selector for marker in PROCEDURAL_SELECTOR_MARKERS)):
+        return None
+    rule.selector = selector
+    if domains:
+        include = set()
+        exclude = set()
+        for domain in domains.lower().split(','):
+            domain = domain.strip()
+            # entity rules like google.* need the public suffix list
+            if not domain or domain.endswith('.*'):
+                continue
+            if domain.startswith('~'):
+                exclude.add(domain[1:])
+            else:
+                include.add(domain)
+        if not include and not exclude:
+            return None
+        rule.include_domains = include or None
+        rule.exclude_domains = exclude or None
+    return rule
+
+def apply_filter_options(rule, options):
+    include_types = 0
+    exclude_types = 0
+    for option in options.split(','):
+        option = option.strip().lower()
+        negated = option.startswith('~')
+        name = option.lstrip('~')
+        value = None
+        if '=' in name:
+            name, value = name.split('=', 1)
+        if name in FILTER_TYPE_OPTIONS:
+            if negated:
+                exclude_types |= FILTER_TYPE_OPTIONS[name]
+            else:
+                include_types |= FILTER_TYPE_OPTIONS[name]
+        elif name == 'all':
+            include_types |= ALL_TYPES
+        elif name in ('third-party', '3p'):
+            rule.third_party = not negated
+        elif name in ('first-party', '1p'):
+            rule.third_party = negated
+        elif name == 'match-case':
+            rule.match_case = True
+        elif name == 'important':
+            rule.important = True
+        elif name in ('domain', 'from') and value:
+            for domain in value.lower().split('|'):
+                if domain.startswith('~'):
+                    if rule.exclude_domains is None:
+                        rule.exclude_domains = set()
+                    rule.exclude_domains.add(domain[1:])
+                else:
+                    if rule.include_domains is None:
+                        rule.include_domains = set()
+                    rule.include_domains.add(domain)
+        else:
+            # unknown or unsupported option
+            return False
+    if include_types:
+        rule.types = include_types & ~exclude_types
+    elif exclude_types:
+        rule.types = ALL_TYPES & ~TYPE_DOCUMENT & ~exclude_types
+    return rule.types != 0
+
+def compile_filter_list(text, lists):
+    rules = []
+    for line in text.splitlines():
+        rule = parse_filter(line, lists)
+        if rule is not None:
+            rules.append(rule)
+    return rules
+
+def rule_tokens(rule):
+    if isinstance(rule, NetworkFilter) and rule.host is None and rule.pattern:
+        return filter_pattern_tokens(rule.pattern)
+    return ()
+
+def compile_filter_chunk(lines, lists):
+    """Parse part of a filter list. Runs in the compile pool's workers.
+
+    Returns ``(lists, hosts, rules, tokens)``: plain host rules as bare names,
+    which are much cheaper to send back than NetworkFilter objects, and every
+    other rule with its candidate bucket tokens.
+    """
+    hosts = []
+    rules = []
+    tokens = []
+    for line in lines:
+        rule = parse_filter(line, lists)
+        if rule is None:
+            continue
+        if rule.is_plain_host():
+            hosts.append(rule.host)
+        else:
+            rules.append(rule)
+            tokens.append(rule_tokens(rule))
+    return lists, hosts, rules, tokens
+
+# lines per work item: big enough to keep the per-task overhead down, small
+# enough that a single EasyList is spread across several workers
+FILTER_CHUNK_LINES = 20000
+# below this, starting worker processes costs more than it saves
+PARALLEL_COMPILE_MIN_LINES = 50000
+# parsing is quick enough that more workers mostly add start-up cost and
+# memory, and the browser has better uses for the other cores
+MAX_COMPILE_WORKERS = 4
+
+@contextmanager
+def spawned_main(module_name):
+    """Have processes spawned inside the block start from ``module_name``.
+
+    A spawned child re-imports the parent's __main__ before it runs anything.
+    For the browser that is main.py, which would load PyQt5, QtWebEngine and
+    the icon resources in every compile worker just to parse text.
+    """
+    main_module = sys.modules['__main__']
+    spec = getattr(main_module, '__spec__', None)
+    main_module.__spec__ = importlib.machinery.ModuleSpec(module_name, None)
+    try:
+        yield
+    finally:
+        main_module.__spec__ = spec
+
+def compile_filter_lists(texts, workers=None):
+    """Parse ``{lists: text}`` into ``{lists: [chunk, ...]}``.
+
+    Each list is cut into chunks that are parsed on a process pool, so a cold
+    compile scales with the number of cores, up to MAX_COMPILE_WORKERS,
+    rather than the number of lines.
+    The chunks are merged into an engine with FilterEngine.add_compiled().
+    """
+    jobs = []
+    for lists, text in texts.items():
+        lines = text.splitlines()
+        for start in range(0, len(lines), FILTER_CHUNK_LINES):
+            jobs.append((lists, lines[start:start + FILTER_CHUNK_LINES]))
+    workers = min(workers or os.cpu_count() or 1, MAX_COMPILE_WORKERS, len(jobs))
+    total_lines = sum(len(lines) for _, lines in jobs)
+    if workers > 1 and total_lines >= PARALLEL_COMPILE_MIN_LINES:
+        try:
+            compiled = {lists: [] for lists in texts}
+            # spawn rather than fork: a forked child would inherit locks held
+            # by Qt's and Chromium's threads at the moment of the fork
+            context = multiprocessing.get_context('spawn')
+            # workers are started by submit(), so all of it runs in the block
+            with spawned_main(__name__), \
+                    ProcessPoolExecutor(workers, mp_context=context) as executor:
+                futures = [executor.submit(compile_filter_chunk, lines, lists)
+                           for lists, lines in jobs]
+                for future in futures:
+                    chunk = future.result()
+                    compiled[chunk[0]].append(chunk)
+            return compiled
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Error compiling filter lists in parallel, falling back to serial: {e}")
+    compiled = {lists: [] for lists in texts}
+    for lists, lines in jobs:
+        compiled[lists].append(compile_filter_chunk(lines, lists))
+    return compiled
+
+def host_suffixes(host):
+    labels = host.split('.')
+    return ['.'.join(labels[i:]) for i in range(len(labels))]
+
+def hiding_css(selectors):
+    # one rule per selector: a selector this Chromium doesn't understand only
+    # drops its own rule instead of the whole group
+    return ''.join(f"{selector}{{display:none!important}}\n" for selector in selectors)
+
+class CosmeticFilters:
+    """Element hiding rules, precompiled into stylesheets.
+
+    Generic rules make up one sheet shared by every page. Domain rules and
+    exceptions are indexed by the domain they name, so finding a page's rules
+    means looking at its host's few suffixes, however many rules are loaded.
+    Every index counts the rules behind an entry, so removing one of two
+    identical rules keeps the element hidden.
+
+    A hiding rule's own ``~domain`` exclusions are indexed apart from the
+    ``#@#`` exceptions. They only take back that rule, so another rule
+    hiding the same selector still applies on the excluded domain.
+    """
+    def __init__(self):
+        self.generic = {}
+        # domain -> {selector: count}; exceptions use '' for the ones that
+        # apply everywhere
+        self.domains = {}
+        self.exceptions = {}
+        # excluded domain -> {(scope, selector, excluded domains): count},
+        # where scope is the domain the rule hides on, or '' for generic
+        self.exclusions = {}
+        self.generic_css = None
+        self.domain_css = {}
+
+    def add(self, rule):
+        self.update(rule, 1)
+
+    def remove(self, rule):
+        self.update(rule, -1)
+
+    def update(self, rule, delta):
+        selector = rule.selector
+        if rule.exception:
+            for domain in rule.include_domains or ('',):
+                self.count(self.exceptions, domain, selector, delta)
+            self.generic_css = None
+            return
+        if rule.include_domains:
+            for domain in rule.include_domains:
+                self.count(self.domains, domain, selector, delta)
+                self.domain_css.pop(domain, None)
+        else:
+            count = self.generic.get(selector, 0) + delta
+            if count > 0:
+                self.generic[selector] = count
+            else:
+                self.generic.pop(selector, None)
+            self.generic_css = None
+        if rule.exclude_domains:
+            excluded = frozenset(rule.exclude_domains)
+            for scope in rule.include_domains or ('',):
+                for domain in excluded:
+                    self.count(self.exclusions, domain, (scope, selector, excluded), delta)
+
+    def count(self, index, domain, selector, delta):
+        # replace the per-domain dict rather than mutate it, so the GUI
+        # thread never iterates one that an update is changing
+        selectors = dict(index.get(domain, ()))
+        count = selectors.get(selector, 0) + delta
+        if count > 0:
+            selectors[selector] = count
+        else:
+            selectors.pop(selector, None)
+        if selectors:
+            index[domain] = selectors
+        else:
+            index.pop(domain, None)
+
+    def generic_stylesheet(self):
+        css = self.generic_css
+        if css is None:
+            unhidden = self.exceptions.get('', {})
+            css = hiding_css(s for s in list(self.generic) if s not in unhidden)
+            self.generic_css = css
+        return css
+
+    def stylesheets(self, host):
+        """Return ``(site_css, generic_css)`` for a page on ``host``.
+
+        ``generic_css`` is None unless the page unhides some generic rules,
+        in which case it is the generic sheet without them and replaces the
+        shared one.
+        """
+        suffixes = host_suffixes(host.lower()) if host else []
+        unhidden = set()
+        for suffix in suffixes:
+            unhidden.update(self.exceptions.get(suffix, ()))
+        excluded = self.excluded_rules(suffixes)
+        if not unhidden and not excluded:
+            parts = []
+            for suffix in suffixes:
+                if suffix in self.domains:
+                    css = self.domain_css.get(suffix)
+                    if css is None:
+                        css = self.domain_css[suffix] = hiding_css(self.domains.get(suffix, ()))
+                    parts.append(css)
+            return ''.join(parts), None
+        unhidden.update(self.exceptions.get('', ()))
+        selectors = []
+        for suffix in suffixes:
+            selectors.extend(s for s in self.domains.get(suffix, ())
+                             if s not in unhidden and (suffix, s) not in excluded)
+        unhidden.update(selector for scope, selector in excluded if not scope)
+        generic_css = None
+        if any(selector in self.generic for selector in unhidden):
+            generic_css = hiding_css(s for s in list(self.generic) if s not in unhidden)
+        return hiding_css(selectors), generic_css
+
+    def excluded_rules(self, suffixes):
+        """Return the ``(scope, selector)`` pairs every rule excludes this host from."""
+        matched = {}
+        for suffix in suffixes:
+            # a rule excluding two of the suffixes is still one rule
+            matched.update(self.exclusions.get(suffix, ()))
+        if not matched:
+            return set()
+        counts = {}
+        for (scope, selector, _), count in matched.items():
+            counts[scope, selector] = counts.get((scope, selector), 0) + count
+        excluded = set()
+        for (scope, selector), count in counts.items():
+            index = self.domains.get(scope, {}) if scope else self.generic
+            if count >= index.get(selector, 0):
+                excluded.add((scope, selector))
+        return excluded
+
+VERDICT_CACHE_SIZE = 4096
+
+class FilterEngine:
+    """Compiled network filters.
+
+    Plain ``||host^`` rules live in a DomainTrie; everything else is bucketed
+    under its rarest token so a request only tests the few rules that share a
+    token with its URL. Host-level verdicts are memoised in a bounded LRU,
+    since a page load asks about the same few dozen hosts again and again.
+    """
+    def __init__(self, verdict_cache_size=VERDICT_CACHE_SIZE):
+        # the cache belongs to this engine, so swapping in a freshly loaded
+        # engine can never serve verdicts from the old lists
+        self.cached_host_verdict = lru_cache(maxsize=verdict_cache_size)(self.host_verdict)
+        self.hosts = DomainTrie()
+        # optional read-only HostSnapshot holding the bulk of the plain hosts,
+        # and the list flags withdrawn from it by incremental updates
+        self.base_hosts = None
+        self.removed_hosts = {}
+        self.document_exceptions = DomainTrie()
+        self.block_buckets = {}
+        # $important rules are kept apart so they are checked even when a
+        # host rule already blocked the request
+        self.important_buckets = {}
+        self.exception_buckets = {}
+        # the block rules that can match a site's own requests: host-anchored
+        # patterns by their host, $~third-party and $domain= rules by token
+        self.same_site_hosts = {}
+        self.same_site_buckets = {}
+        self.filters = {}
+        self.cosmetic = CosmeticFilters()
+
+    @classmethod
+    def from_snapshot(cls, snapshot, rules=True):
+        """Build an engine on top of a HostSnapshot.
+
+        With ``rules=False`` only the mapped host trie is used, which costs
+        next to nothing; parsing the URL and cosmetic rules is what takes
+        time on big lists.
+        """
+        engine = cls()
+        engine.base_hosts = snapshot
+        if not rules:
+            return engine
+        # bucket tokens were picked when the snapshot was written, so the
+        # rules can be filed straight away
+        for lists, token, text in snapshot.rule_lines():
+            rule = parse_filter(text, lists)
+            if rule is not None:
+                engine.add_filter(rule, token)
+        return engine
+
+    def add_hosts(self, hosts, lists):
+        self.hosts.update(hosts, lists)
+        self.cached_host_verdict.cache_clear()
+
+    def host_entries(self):
+        if self.base_hosts is None:
+            return self.hosts.entries()
+        merged = {}
+        for host, lists in self.base_hosts.entries():
+            lists &= ~self.removed_hosts.get(host, 0)
+            if lists:
+                merged[host] = lists
+        for host, lists in self.hosts.entries():
+            merged[host] = merged.get(host, 0) | lists
+        return merged.items()
+
+    def host_names(self, lists):
+        return [host for host, host_lists in self.host_entries() if host_lists & lists]
+
+    def rule_entries(self):
+        return [(rule.lists, rule.token or '', text) for text, rule in self.filters.items()]
+
+    def add_filters(self, rules):
+        rules = list(rules)
+        self.add_compiled([(0, (), rules, [rule_tokens(rule) for rule in rules])])
+
+    def add_compiled(self, chunks):
+        """Merge the partial results of compile_filter_chunk()."""
+        chunks = list(chunks)
+        # count how often each usable token shows up across all chunks so
+        # every rule can be filed under the rarest one it has
+        frequency = {}
+        for _, _, _, chunk_tokens in chunks:
+            for tokens in chunk_tokens:
+                for token in tokens:
+                    frequency[token] = frequency.get(token, 0) + 1
+        for lists, hosts, rules, chunk_tokens in chunks:
+            if hosts:
+                self.hosts.update(hosts, lists)
+            for rule, tokens in zip(rules, chunk_tokens):
+                token = ''
+                if tokens:
+                    token = min(tokens, key=lambda t: (t in COMMON_URL_TOKENS,
+                                                       frequency[t], -len(t)))
+                self.add_filter(rule, token)
+        self.cached_host_verdict.cache_clear()
+
+    def add_filter(self, rule, token=None):
+        self.cached_host_verdict.cache_clear()
+        if rule.is_plain_host():
+            self.hosts.add(rule.host, rule.lists)
+            return
+        existing = self.filters.get(rule.text)
+        if existing is not None:
+            existing.lists |= rule.lists
+            return
+        self.filters[rule.text] = rule
+        if isinstance(rule, CosmeticFilter):
+            self.cosmetic.add(rule)
+            return
+        if rule.exception and rule.types & TYPE_DOCUMENT and rule.host is not None:
+            self.document_exceptions.add(rule.host, rule.lists)
+            return
+        if rule.host is not None:
+            node = self.hosts.node(rule.host)
+            node.rules = (node.rules or []) + [rule]
+            return
+        buckets = self.buckets_for(rule)
+        if token is None:
+            tokens = filter_pattern_tokens(rule.pattern) if rule.pattern else []
+            token = ''
+            if tokens:
+                token = min(tokens, key=lambda t: (t in COMMON_URL_TOKENS,
+                                                   len(buckets.get(t, ())), -len(t)))
+        rule.token = token
+        buckets[token] = buckets.get(token, []) + [rule]
+        index, key = self.same_site_slot(rule)
+        if index is not None:
+            index[key] = index.get(key, []) + [rule]
+
+    def same_site_slot(self, rule):
+        """Return ``(index, key)`` for a rule that can block a site's own requests."""
+        if rule.exception or rule.third_party:
+            return None, None
+        anchor = ANCHORED_HOST_RE.match(rule.pattern.lower()) if rule.pattern else None
+        if anchor:
+            return self.same_site_hosts, anchor.group(1)
+        if rule.third_party is False or rule.include_domains is not None:
+            return self.same_site_buckets, rule.token
+        return None, None
+
+    def buckets_for(self, rule):
+        if rule.exception:
+            return self.exception_buckets
+        return self.important_buckets if rule.important else self.block_buckets
+
+    def filter_texts(self, lists):
+        return [text for text, rule in self.filters.items() if rule.lists & lists]
+
+    def filter_keys(self, lists):
+        # plain host rules are stored by host, so they are keyed by the
+        # canonical ||host^ form on both sides of a diff
+        keys = {f"||{host}^" for host in self.host_names(lists)}
+        keys.update(self.filter_texts(lists))
+        return keys
+
+    def remove_filter(self, key, lists):
+        """Withdraw one list's claim on a rule, dropping it once unclaimed."""
+        self.cached_host_verdict.cache_clear()
+        host = PLAIN_HOST_FILTER_RE.match(key)
+        if host:
+            host = host.group(1)
+            self.hosts.discard(host, lists)
+            if self.base_hosts is not None:
+                self.removed_hosts[host] = self.removed_hosts.get(host, 0) | lists
+            return
+        rule = self.filters.get(key)
+        if rule is None:
+            return
+        rule.lists &= ~lists
+        if rule.lists:
+            return
+        del self.filters[key]
+        if isinstance(rule, CosmeticFilter):
+            self.cosmetic.remove(rule)
+            return
+        # replace containers rather than mutate them, so a lookup running on
+        # the IO thread keeps iterating a consistent list
+        if rule.exception and rule.types & TYPE_DOCUMENT and rule.host is not None:
+            self.document_exceptions.discard(rule.host, lists)
+        elif rule.host is not None:
+            node = self.hosts.node(rule.host)
+            node.rules = [r for r in node.rules or () if r is not rule] or None
+        else:
+            for buckets, key in ((self.buckets_for(rule), rule.token),
+                                 self.same_site_slot(rule)):
+                if buckets is None:
+                    continue
+                bucket = [r for r in buckets.get(key, ()) if r is not rule]
+                if bucket:
+                    buckets[key] = bucket
+                else:
+                    buckets.pop(key, None)
+
+    def remove_lists(self, lists):
+        """Drop every rule that only the given lists contributed."""
+        for key in self.filter_keys(lists):
+            self.remove_filter(key, lists)
+
+    def apply_changes(self, lists, added, removed):
+        """Remove rule keys and merge compiled chunks for one list."""
+        for key in removed:
+            self.remove_filter(key, lists)
+        self.add_compiled(added)
+        self.cached_host_verdict.cache_clear()
+
+    def verdict_cache_info(self):
+        return self.cached_host_verdict.cache_info()
+
+    def host_verdict(self, host, first_party_host, type_bit):
+        """Return ``(lists, final)`` for the rules that only look at hosts.
+
+        ``final`` means only an $important URL rule can still change the
+        outcome: an $important host block, or an exception covering the
+        whole host or page (returned as ``(0, True)``).
+        """
+        third_party = bool(first_party_host) and site_of(host) != site_of(first_party_host)
+        lists, rules = self.hosts.walk(host)
+        if self.base_hosts is not None:
+            lists |= self.base_hosts.match(host, self.removed_hosts)
+        if type_bit == TYPE_DOCUMENT:
+            # plain host rules don't cover top-level navigations
+            lists = 0
+        exempt = False
+        for rule in rules:
+            if rule.applies(type_bit, first_party_host, third_party):
+                if rule.exception:
+                    exempt = True
+                elif rule.important:
+                    return rule.lists, True
+                else:
+                    lists |= rule.lists
+        if first_party_host and self.document_exceptions.match(first_party_host):
+            return 0, True
+        if exempt:
+            return 0, True
+        return lists, False
+
+    def match(self, url, host, first_party_host='', type_bit=TYPE_OTHER, check_urls=True):
+        """Return the list flags that block this request, or 0 to allow it.
+
+        ``type_bit`` is one of the TYPE_* flags. With ``check_urls`` off, a
+        request that no host rule blocks is only tested against the rules that
+        can match a site's own requests, not every URL pattern rule.
+        """
+        lists, final = self.cached_host_verdict(host, first_party_host, type_bit)
+        if final and (lists or not self.important_buckets):
+            return lists
+        if not (final or lists or check_urls or self.same_site_hosts or self.same_site_buckets):
+            return 0
+
+        third_party = bool(first_party_host) and site_of(host) != site_of(first_party_host)
+        url_lower = url.lower()
+        tokens = set(FILTER_TOKEN_RE.findall(url_lower))
+        tokens.add('')
+        if final:
+            # a host or page exception gives way to $important URL rules only
+            rule = self.find(self.important_buckets, tokens, url, url_lower,
+                             type_bit, first_party_host, third_party)
+            return rule.lists if rule is not None else 0
+        if not (lists or check_urls):
+            rule = self.find_same_site(host, tokens, url, url_lower,
+                                       type_bit, first_party_host, third_party)
+            if rule is None:
+                return 0
+            if rule.important:
+                return rule.lists
+            lists = rule.lists
+        else:
+            rule = self.find(self.important_buckets, tokens, url, url_lower,
+                             type_bit, first_party_host, third_party)
+            if rule is not None:
+                return rule.lists
+            if not lists:
+                rule = self.find(self.block_buckets, tokens, url, url_lower,
+                                 type_bit, first_party_host, third_party)
+                if rule is None:
+                    return 0
+                lists = rule.lists
+        if self.find(self.exception_buckets, tokens, url, url_lower,
+                     type_bit, first_party_host, third_party) is not None:
+            return 0
+        return lists
+
+    def find_same_site(self, host, tokens, url, url_lower, type_bit, first_party_host,
+                       third_party):
+        """Return the rule blocking a site's own request, preferring $important ones."""
+        rules = []
+        for suffix in host_suffixes(host):
+            rules.extend(self.same_site_hosts.get(suffix, ()))
+        for token in tokens:
+            rules.extend(self.same_site_buckets.get(token, ()))
+        found = None
+        for rule in rules:
+            if (rule.applies(type_bit, first_party_host, third_party)
+                    and rule.matches(url, url_lower)):
+                if rule.important:
+                    return rule
+                found = found or rule
+        return found
+
+    def find(self, buckets, tokens, url, url_lower, type_bit, first_party_host, third_party):
+        for token in tokens:
+            bucket = buckets.get(token)
+            if bucket:
+                for rule in bucket:
+                    if (rule.applies(type_bit, first_party_host, third_party)
+                            and rule.matches(url, url_lower)):
+                        return rule
+        return None
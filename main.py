@@ -1,13 +1,18 @@
 import sys
 import csv
+import sqlite3
+import queue
+import bisect
+import heapq
 import re
 import requests
 from urllib.parse import quote
 import json
 import os
+import time
 import icons_rc
 import pyttsx3
-from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor, QWebEngineUrlRequestInfo
 from PyQt5 import QtWidgets, QtCore, QtWebEngineWidgets, QtGui
 from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEnginePage, QWebEngineProfile
 from PyQt5.QtCore import QUrl, QTimer, QFileInfo, QDir, pyqtSignal, QThread, Qt, QRunnable, QThreadPool, QEasingCurve, QPropertyAnimation, QPoint, Qt, QUrlQuery, QDateTime
@@ -16,7 +21,13 @@ from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkRepl
 from PyQt5.QtGui import QIcon, QCursor
 from datetime import datetime, timedelta
 from functools import partial
-from PyQt5.QtWebEngineWidgets import QWebEngineSettings
+from PyQt5.QtWebEngineWidgets import QWebEngineSettings, QWebEngineScript
+from filter_engine import (
+    AD_LIST, TRACKER_LIST, DomainTrie, SnapshotError, HostSnapshot, write_snapshot,
+    TYPE_DOCUMENT, TYPE_SUBDOCUMENT, TYPE_SCRIPT, TYPE_IMAGE, TYPE_STYLESHEET,
+    TYPE_OBJECT, TYPE_XMLHTTPREQUEST, TYPE_PING, TYPE_MEDIA, TYPE_FONT, TYPE_OTHER,
+    RESOURCE_TYPE_BITS, PLAIN_HOST_FILTER_RE, site_of, parse_filter, compile_filter_lists,
+    host_suffixes, FilterEngine)
 
 class DownloadItemWidget(QtWidgets.QWidget):
     def __init__(self, download_info):
@@ -228,6 +239,152 @@ class DownloadManager(QtWidgets.QWidget):
             download['widget'].download_info['state'] = 'completed'
             download['widget'].update_state()
 
+class BlockerStatsPage(QtWidgets.QWidget):
+    def __init__(self, blocker, interceptors=None, parent=None):
+        super().__init__(parent)
+        self.blocker = blocker
+        self.interceptors = interceptors
+        self.setStyleSheet("""
+            BlockerStatsPage {
+                background-color: #f8f9fa;
+            }
+            QTreeWidget {
+                background: white;
+                border: 1px solid #e9ecef;
+                border-radius: 8px;
+                padding: 4px;
+            }
+            QPushButton {
+                background: #e9ecef;
+                border: 1px solid #dee2e6;
+                color: #212529;
+                padding: 8px 32px;
+                min-width: 100px;
+            }
+            QPushButton:hover {
+                background: #dee2e6;
+            }
+            QPushButton:pressed {
+                background: #ced4da;
+            }
+        """)
+        self.init_ui()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(2000)
+        self.refresh()
+
+    def init_ui(self):
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(24, 16, 24, 24)
+        layout.setSpacing(16)
+
+        header = QtWidgets.QLabel("Blocker Statistics")
+        header.setStyleSheet("""
+            font-size: 24px;
+            font-weight: 700;
+            color: #212529;
+            padding-bottom: 8px;
+        """)
+        header.setAlignment(QtCore.Qt.AlignCenter)
+        layout.addWidget(header)
+
+        self.tree = QtWidgets.QTreeWidget()
+        self.tree.setHeaderLabels(["Statistic", "Value"])
+        self.tree.setColumnWidth(0, 320)
+        layout.addWidget(self.tree)
+
+        control_layout = QtWidgets.QHBoxLayout()
+        reset_btn = QtWidgets.QPushButton("Reset")
+        reset_btn.clicked.connect(self.reset_stats)
+        export_btn = QtWidgets.QPushButton("Export JSON")
+        export_btn.clicked.connect(self.export_stats)
+        control_layout.addWidget(reset_btn)
+        control_layout.addWidget(export_btn)
+        control_layout.addStretch()
+        layout.addLayout(control_layout)
+
+    def refresh(self):
+        if not self.isVisible() and self.tree.topLevelItemCount():
+            return
+        stats = self.blocker.stats.snapshot()
+        expanded = {self.tree.topLevelItem(i).text(0)
+                    for i in range(self.tree.topLevelItemCount())
+                    if self.tree.topLevelItem(i).isExpanded()}
+        self.tree.clear()
+        summary = self.add_group("Summary", expanded or {"Summary"})
+        self.add_row(summary, "Requests checked", stats['decisions'])
+        self.add_row(summary, "Blocked", stats['blocked'])
+        self.add_row(summary, "Allowed", stats['allowed'])
+        self.add_row(summary, "Skipped full matching", f"{stats['skipped_share']:.1%}")
+        self.add_row(summary, "Mean decision time", f"{stats['latency']['mean_us']:.1f} us")
+        self.add_row(summary, "Slowest decision", f"{stats['latency']['max_us']:.1f} us")
+        cache = self.blocker.verdict_cache_stats()
+        self.add_row(summary, "Verdict cache hit rate", f"{cache['hit_rate']:.1%}")
+
+        by_list = self.add_group("Blocked by list", expanded)
+        for name, count in stats['blocked_by_list'].items():
+            self.add_row(by_list, name, count)
+
+        skipped = self.add_group("Skipped by policy", expanded)
+        for reason, count in stats['skipped'].items():
+            self.add_row(skipped, reason, count)
+
+        by_type = self.add_group("By resource type", expanded)
+        for name, counts in sorted(stats['by_resource_type'].items()):
+            self.add_row(by_type, name, f"{counts['blocked']} blocked / {counts['allowed']} allowed")
+
+        latency = self.add_group("Decision latency", expanded)
+        for label, count in stats['latency']['histogram'].items():
+            self.add_row(latency, label, count)
+
+        if self.interceptors is not None:
+            stages = self.add_group("Interceptor stages", expanded)
+            self.add_row(stages, "Requests", self.interceptors.requests)
+            for name, stage in self.interceptors.stage_stats().items():
+                self.add_row(stages, name,
+                             f"{stage['total_ms']:.1f} ms total, {stage['mean_us']:.1f} us mean, "
+                             f"{stage['max_us']:.0f} us max, stopped {stage['stopped_chain']}")
+
+        pages = self.add_group("Top blocked hosts by page", expanded)
+        for page, hosts in stats['top_blocked_hosts'].items():
+            page_item = self.add_row(pages, page, sum(hosts.values()))
+            for host, count in hosts.items():
+                self.add_row(page_item, host, count)
+
+    def add_group(self, title, expanded):
+        item = QtWidgets.QTreeWidgetItem([title, ""])
+        self.tree.addTopLevelItem(item)
+        item.setExpanded(title in expanded)
+        return item
+
+    def add_row(self, parent, name, value):
+        return QtWidgets.QTreeWidgetItem(parent, [str(name), str(value)])
+
+    def reset_stats(self):
+        self.blocker.stats.reset()
+        if self.interceptors is not None:
+            self.interceptors.reset_stats()
+        self.refresh()
+
+    def export_stats(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Export Blocker Statistics", "blocker_stats.json", "JSON Files (*.json)"
+        )
+        if path:
+            try:
+                stats = self.blocker.stats.snapshot(top_hosts=100)
+                stats['verdict_cache'] = self.blocker.verdict_cache_stats()
+                if self.interceptors is not None:
+                    stats['interceptor_stages'] = self.interceptors.stage_stats()
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(stats, f, indent=2)
+            except OSError as e:
+                QtWidgets.QMessageBox.critical(
+                    self, "Export Error",
+                    f"Failed to export statistics:\n{str(e)}"
+                )
+
 class AboutDialog(QtWidgets.QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -690,108 +847,1047 @@ class AccessibilityPage(QtWidgets.QWidget):
 
 
 
-class AdBlocker(QWebEngineUrlRequestInterceptor):
+# runs at DocumentCreation, before there may be a documentElement to attach to
+COSMETIC_SCRIPT_TEMPLATE = """
+(function(role, css, replacesGeneric) {
+    if (role === 'generic' && window.__pybrowseGenericReplaced) {
+        return;
+    }
+    if (replacesGeneric) {
+        window.__pybrowseGenericReplaced = true;
+        var old = document.querySelector('style[data-pybrowse="generic"]');
+        if (old) {
+            old.remove();
+        }
+    }
+    var style = document.createElement('style');
+    style.setAttribute('data-pybrowse', role);
+    style.textContent = css;
+    if (document.documentElement) {
+        document.documentElement.appendChild(style);
+        return;
+    }
+    new MutationObserver(function(mutations, observer) {
+        if (document.documentElement) {
+            observer.disconnect();
+            document.documentElement.appendChild(style);
+        }
+    }).observe(document, {childList: true});
+})(%s, %s, %s);
+"""
+
+def cosmetic_script(name, role, css, replaces_generic=False, sub_frames=False):
+    script = QWebEngineScript()
+    script.setName(name)
+    script.setInjectionPoint(QWebEngineScript.DocumentCreation)
+    # a world of our own, so pages can't see or clobber the marker variable
+    script.setWorldId(QWebEngineScript.ApplicationWorld)
+    script.setRunsOnSubFrames(sub_frames)
+    script.setSourceCode(COSMETIC_SCRIPT_TEMPLATE % (
+        json.dumps(role), json.dumps(css), 'true' if replaces_generic else 'false'))
+    return script
+
+LIST_NAMES = {
+    AD_LIST: "Ads",
+    TRACKER_LIST: "Trackers",
+}
+
+TYPE_NAMES = {
+    TYPE_DOCUMENT: "document",
+    TYPE_SUBDOCUMENT: "subdocument",
+    TYPE_SCRIPT: "script",
+    TYPE_IMAGE: "image",
+    TYPE_STYLESHEET: "stylesheet",
+    TYPE_OBJECT: "object",
+    TYPE_XMLHTTPREQUEST: "xmlhttprequest",
+    TYPE_PING: "ping",
+    TYPE_MEDIA: "media",
+    TYPE_FONT: "font",
+    TYPE_OTHER: "other",
+}
+
+class BlockerStats:
+    """Counters kept by AdBlocker.interceptRequest on Chromium's IO thread.
+
+    Recording is a handful of dict/list updates; the GUI only reads, via
+    snapshot(), which copies everything into plain JSON-ready data.
+    """
+    # upper bounds of the latency buckets, in microseconds
+    LATENCY_BUCKETS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+    MAX_PAGES = 200
+
+    def __init__(self, list_names=None):
+        self.list_names = list_names or LIST_NAMES
+        self.bucket_bounds_ns = [bound * 1000 for bound in self.LATENCY_BUCKETS_US]
+        self.reset()
+
+    def reset(self):
+        self.started = datetime.now()
+        self.blocked = 0
+        self.allowed = 0
+        # requests the InterceptPolicy let through, or only host-checked
+        self.skipped = {}
+        self.blocked_by_list = {}
+        self.by_type = {}
+        self.latency_histogram = [0] * (len(self.LATENCY_BUCKETS_US) + 1)
+        self.total_ns = 0
+        self.max_ns = 0
+        # first-party host (the page a tab shows) -> {blocked host: count}
+        self.blocked_hosts = {}
+
+    def record(self, lists, type_bit, host, first_party_host, elapsed_ns, skipped=None):
+        if skipped is not None:
+            self.skipped[skipped] = self.skipped.get(skipped, 0) + 1
+        counts = self.by_type.get(type_bit)
+        if counts is None:
+            counts = self.by_type[type_bit] = [0, 0]
+        if lists:
+            self.blocked += 1
+            counts[0] += 1
+            remaining = lists
+            while remaining:
+                flag = remaining & -remaining
+                remaining ^= flag
+                self.blocked_by_list[flag] = self.blocked_by_list.get(flag, 0) + 1
+            page = self.blocked_hosts.get(first_party_host)
+            if page is None:
+                if len(self.blocked_hosts) >= self.MAX_PAGES:
+                    # forget the page we started tracking longest ago
+                    self.blocked_hosts.pop(next(iter(self.blocked_hosts)), None)
+                page = self.blocked_hosts[first_party_host] = {}
+            page[host] = page.get(host, 0) + 1
+        else:
+            self.allowed += 1
+            counts[1] += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.latency_histogram[bisect.bisect_left(self.bucket_bounds_ns, elapsed_ns)] += 1
+
+    def snapshot(self, top_hosts=10):
+        decisions = self.blocked + self.allowed
+        histogram = {}
+        labels = [f"<= {bound} us" for bound in self.LATENCY_BUCKETS_US]
+        labels.append(f"> {self.LATENCY_BUCKETS_US[-1]} us")
+        for label, count in zip(labels, list(self.latency_histogram)):
+            histogram[label] = count
+        pages = {}
+        for page, hosts in list(self.blocked_hosts.items()):
+            top = sorted(dict(hosts).items(), key=lambda item: item[1], reverse=True)
+            pages[page or "(no page)"] = dict(top[:top_hosts])
+        return {
+            'since': self.started.isoformat(),
+            'decisions': decisions,
+            'blocked': self.blocked,
+            'allowed': self.allowed,
+            'skipped': dict(self.skipped),
+            'skipped_share': sum(self.skipped.values()) / decisions if decisions else 0.0,
+            'blocked_by_list': {self.list_names.get(flag, str(flag)): count
+                                for flag, count in dict(self.blocked_by_list).items()},
+            'by_resource_type': {TYPE_NAMES.get(type_bit, str(type_bit)):
+                                 {'blocked': counts[0], 'allowed': counts[1]}
+                                 for type_bit, counts in dict(self.by_type).items()},
+            'latency': {
+                'mean_us': self.total_ns / decisions / 1000 if decisions else 0.0,
+                'max_us': self.max_ns / 1000,
+                'histogram': histogram,
+            },
+            'top_blocked_hosts': pages,
+        }
+
+# reasons InterceptPolicy gives for not running the full matcher
+SKIP_MAIN_FRAME = "main frame"
+SKIP_TYPED_NAVIGATION = "typed navigation"
+SKIP_SCHEME = "non-network scheme"
+SKIP_SAME_SITE = "same site, generic URL rules skipped"
+
+NETWORK_SCHEMES = {'http', 'https', 'ws', 'wss'}
+
+class InterceptPolicy:
+    """Decides how much matching a request needs before it reaches the engine.
+
+    Top-level navigations are what the user asked for and are left alone by
+    default (typed ones always are). Requests for a page's own site are
+    checked against host rules and the few URL rules that can target a
+    site's own requests: patterns anchored to the host, $~third-party and
+    $domain= rules. The bulk of the generic URL pattern rules, the expensive
+    part, is only scanned for other sites.
+    """
+    def __init__(self, skip_main_frame=True, same_site_host_rules_only=True):
+        self.skip_main_frame = skip_main_frame
+        self.same_site_host_rules_only = same_site_host_rules_only
+
+    @classmethod
+    def from_settings(cls):
+        settings = QtCore.QSettings("PyBrowse", "PyBrowse")
+        return cls(settings.value("adblock/skip_main_frame", True, bool),
+                   settings.value("adblock/same_site_host_rules_only", True, bool))
+
+    def skip(self, url, resource_type, navigation_type):
+        """Return why the request needs no matching at all, or None."""
+        if resource_type == QWebEngineUrlRequestInfo.ResourceTypeMainFrame:
+            if navigation_type == QWebEngineUrlRequestInfo.NavigationTypeTyped:
+                return SKIP_TYPED_NAVIGATION
+            if self.skip_main_frame:
+                return SKIP_MAIN_FRAME
+        if url.scheme() not in NETWORK_SCHEMES:
+            return SKIP_SCHEME
+        return None
+
+    def checks_urls(self, host, first_party_host):
+        if not self.same_site_host_rules_only or not first_party_host:
+            return True
+        return site_of(host) != site_of(first_party_host)
+
+FILTER_LISTS = {
+    AD_LIST: "https://easylist.to/easylist/easylist.txt",
+    TRACKER_LIST: "https://easylist.to/easylist/easyprivacy.txt",
+}
+
+# list flags end up as uint32 masks in the snapshot
+MAX_SUBSCRIPTIONS = 32
+SUBSCRIPTIONS_KEY = "adblock/subscriptions"
+
+DEFAULT_SUBSCRIPTIONS = [
+    {'name': "EasyList", 'url': FILTER_LISTS[AD_LIST], 'enabled': True, 'flag': AD_LIST},
+    {'name': "EasyPrivacy", 'url': FILTER_LISTS[TRACKER_LIST], 'enabled': True,
+     'flag': TRACKER_LIST},
+]
+
+def load_subscriptions():
+    settings = QtCore.QSettings("PyBrowse", "PyBrowse")
+    if settings.contains(SUBSCRIPTIONS_KEY):
+        try:
+            return json.loads(settings.value(SUBSCRIPTIONS_KEY, "[]", str))
+        except json.JSONDecodeError as e:
+            print(f"Error reading filter subscriptions: {e}")
+    return [dict(subscription) for subscription in DEFAULT_SUBSCRIPTIONS]
+
+def save_subscriptions(subscriptions):
+    settings = QtCore.QSettings("PyBrowse", "PyBrowse")
+    settings.setValue(SUBSCRIPTIONS_KEY, json.dumps(subscriptions))
+
+def new_subscription(subscriptions, name, url):
+    """Return a subscription with the lowest free list flag, or None if all are taken."""
+    used = 0
+    for subscription in subscriptions:
+        used |= subscription['flag']
+    for bit in range(MAX_SUBSCRIPTIONS):
+        flag = 1 << bit
+        if not used & flag:
+            return {'name': name or url, 'url': url, 'enabled': True, 'flag': flag}
+    return None
+
+def subscription_lists(subscriptions):
+    return {subscription['flag']: subscription['url'] for subscription in subscriptions
+            if subscription.get('enabled', True)}
+
+# used until a real list has been downloaded at least once
+FALLBACK_HOSTS = {
+    AD_LIST: ['ads.google.com', 'googleadservices.com', 'doubleclick.net'],
+    TRACKER_LIST: ['analytics.google.com', 'facebook.com', 'tracking.example.com'],
+}
+
+class FilterListUpdater(QThread):
+    """Downloads and compiles the filter lists off the GUI thread.
+
+    Lists are fetched with If-None-Match/If-Modified-Since. When the live
+    engine already holds a list, only the rules that were added or removed
+    upstream are applied to it; otherwise a fresh engine is built and
+    swapped in.
+
+    Lists whose subscriptions went away are dropped here too, before any
+    download, so rewriting the snapshot never stalls the GUI thread and never
+    overlaps another update of the same engine. The rules of the snapshot
+    loaded at startup are parsed here first, for the same reasons.
+    """
+    engine_ready = pyqtSignal(object)
+    lists_updated = pyqtSignal(int)
+    update_failed = pyqtSignal(str)
+
+    def __init__(self, blocker, filter_lists, dropped=0, fetch=True, snapshot=None):
+        super().__init__(blocker)
+        self.blocker = blocker
+        self.filter_lists = dict(filter_lists)
+        self.dropped = dropped
+        self.fetch_lists = fetch
+        self.snapshot = snapshot
+
+    def fetch(self, url, metadata):
+        """Return the list text, or None if the server says it is unchanged."""
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        response = requests.get(url, headers=headers, timeout=30)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        metadata.clear()
+        if response.headers.get('ETag'):
+            metadata['etag'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            metadata['last_modified'] = response.headers['Last-Modified']
+        return response.text
+
+    def drop_lists(self):
+        blocker = self.blocker
+        blocker.engine.remove_lists(self.dropped)
+        list_metadata = {url: metadata for url, metadata in blocker.list_metadata.items()
+                         if not metadata.get('lists', 0) & self.dropped}
+        if blocker.cache_updated is None:
+            blocker.list_metadata = list_metadata
+            return
+        try:
+            blocker.save_to_cache(last_updated=blocker.cache_updated)
+            blocker.save_list_metadata(list_metadata, blocker.cache_updated)
+        except OSError as e:
+            print(f"Error saving filter cache: {e}")
+
+    def load_rules(self):
+        # the GUI thread started out with the snapshot's hosts only
+        try:
+            engine = FilterEngine.from_snapshot(self.snapshot)
+        except ValueError as e:
+            print(f"Error reading filter cache rules: {e}")
+            # without the rules, the stored validators would only get 304s
+            self.blocker.cache_updated = None
+            return
+        self.engine_ready.emit(engine)
+
+    def run(self):
+        if self.snapshot is not None:
+            self.load_rules()
+        if self.dropped:
+            self.drop_lists()
+        if self.fetch_lists:
+            self.update_lists()
+
+    def update_lists(self):
+        current = self.blocker.engine
+        # conditional requests only make sense if we still hold the rules
+        # the validators refer to
+        have_rules = self.blocker.cache_updated is not None
+        known = self.blocker.list_metadata if have_rules else {}
+        list_metadata = {}
+        texts = {}
+        failed = []
+        for lists, url in self.filter_lists.items():
+            metadata = dict(known.get(url, {}))
+            try:
+                text = self.fetch(url, metadata)
+            except requests.RequestException as e:
+                print(f"Error fetching filter list {url}: {e}")
+                failed.append(lists)
+                if url in known:
+                    list_metadata[url] = known[url]
+                continue
+            # lets the next launch tell which flags a snapshot carries
+            metadata['lists'] = lists
+            list_metadata[url] = metadata
+            if text is not None:
+                texts[lists] = text
+
+        if len(failed) == len(self.filter_lists):
+            self.update_failed.emit("No filter list could be downloaded")
+            return
+        downloaded = compile_filter_lists(texts) if texts else {}
+        incremental = have_rules and all(url in known for url in self.filter_lists.values())
+        if incremental:
+            for lists, chunks in downloaded.items():
+                old_keys = current.filter_keys(lists)
+                new_keys = set()
+                added = []
+                for _, hosts, rules, tokens in chunks:
+                    host_keys = [f"||{host}^" for host in hosts]
+                    new_keys.update(host_keys)
+                    new_keys.update(rule.text for rule in rules)
+                    fresh = [i for i, rule in enumerate(rules) if rule.text not in old_keys]
+                    added.append((lists,
+                                  [host for host, key in zip(hosts, host_keys)
+                                   if key not in old_keys],
+                                  [rules[i] for i in fresh], [tokens[i] for i in fresh]))
+                removed = old_keys.difference(new_keys)
+                current.apply_changes(lists, added, removed)
+                self.lists_updated.emit(lists)
+            engine = current
+        else:
+            engine = FilterEngine()
+            # all downloaded lists at once, so bucket tokens are chosen
+            # against the combined token counts
+            engine.add_compiled(chunk for chunks in downloaded.values() for chunk in chunks)
+            for lists in self.filter_lists:
+                if lists not in downloaded:
+                    # keep serving whatever we had for this list
+                    engine.add_hosts(current.host_names(lists), lists)
+                    engine.add_filters(
+                        rule for rule in (parse_filter(line, lists)
+                                          for line in current.filter_texts(lists))
+                        if rule is not None)
+        if not failed:
+            # a partial update is still worth serving, but it shouldn't reset
+            # the cache age and postpone retrying the lists that failed
+            try:
+                if downloaded or engine is not current:
+                    self.blocker.save_to_cache(engine)
+                self.blocker.save_list_metadata(list_metadata)
+            except OSError as e:
+                print(f"Error saving filter cache: {e}")
+        if engine is not current:
+            self.engine_ready.emit(engine)
+
+class InterceptorChain(QWebEngineUrlRequestInterceptor):
+    """The one request interceptor a profile can have, running a list of stages.
+
+    A stage is any object with a ``name`` and a ``process(info)`` method. It
+    may block, redirect or set headers on the request, and returns True to
+    stop the stages after it from running. The time spent in each stage is
+    added up so the stats page can show what every stage costs.
+    """
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.ad_hosts = set()
-        self.tracker_hosts = set()
-        self.cache_file = "adblocker_cache.json"
+        self.stages = []
+        self.reset_stats()
+
+    def add_stage(self, stage, index=None):
+        # interceptRequest runs on Chromium's IO thread, so the list is
+        # replaced rather than changed under it
+        stages = list(self.stages)
+        stages.insert(len(stages) if index is None else index, stage)
+        self.stages = stages
+
+    def remove_stage(self, name):
+        self.stages = [stage for stage in self.stages if stage.name != name]
+
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def reset_stats(self):
+        # name -> [calls, total ns, max ns, stops, errors]
+        self.timings = {}
+        self.requests = 0
+
+    def interceptRequest(self, info):
+        self.requests += 1
+        clock = time.perf_counter_ns
+        for stage in self.stages:
+            timing = self.timings.get(stage.name)
+            if timing is None:
+                timing = self.timings[stage.name] = [0, 0, 0, 0, 0]
+            start = clock()
+            try:
+                stop = stage.process(info)
+            except Exception as e:
+                print(f"Error in interceptor stage {stage.name}: {e}")
+                timing[4] += 1
+                stop = False
+            elapsed = clock() - start
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+            if stop:
+                timing[3] += 1
+                return
+
+    def stage_stats(self):
+        stats = {}
+        for name, (calls, total_ns, max_ns, stops, errors) in list(self.timings.items()):
+            stats[name] = {
+                'calls': calls,
+                'total_ms': total_ns / 1e6,
+                'mean_us': total_ns / calls / 1000 if calls else 0.0,
+                'max_us': max_ns / 1000,
+                'stopped_chain': stops,
+                'errors': errors,
+            }
+        return stats
+
+# query parameters that only identify a click or campaign, in $removeparam
+# syntax; a regex value is tested against the whole name=value pair
+DEFAULT_PARAM_RULES = """
+$removeparam=/^utm_/
+$removeparam=fbclid
+$removeparam=gclid
+$removeparam=gclsrc
+$removeparam=dclid
+$removeparam=gbraid
+$removeparam=wbraid
+$removeparam=msclkid
+$removeparam=yclid
+$removeparam=twclid
+$removeparam=ttclid
+$removeparam=igshid
+$removeparam=mc_cid
+$removeparam=mc_eid
+$removeparam=_hsenc
+$removeparam=_hsmi
+$removeparam=mkt_tok
+$removeparam=vero_id
+$removeparam=oly_anon_id
+$removeparam=oly_enc_id
+$removeparam=_openstat
+||amazon.com^$removeparam=/^pd_rd_/
+||amazon.com^$removeparam=/^pf_rd_/
+||youtu.be^$removeparam=si
+"""
+
+class ParamRule:
+    __slots__ = ('text', 'exception', 'name', 'regex', 'host', 'include_domains',
+                 'exclude_domains')
+
+    def __init__(self, text):
+        self.text = text
+        self.exception = False
+        self.name = None
+        self.regex = None
+        self.host = None
+        self.include_domains = None
+        self.exclude_domains = None
+
+    def applies(self, name, pair, first_party_host):
+        if self.name is not None and self.name != name:
+            return False
+        if self.regex is not None and not self.regex.search(pair):
+            return False
+        if self.include_domains is not None or self.exclude_domains is not None:
+            suffixes = host_suffixes(first_party_host)
+            if self.exclude_domains and any(s in self.exclude_domains for s in suffixes):
+                return False
+            if self.include_domains and not any(s in self.include_domains for s in suffixes):
+                return False
+        return True
+
+def parse_param_rule(line):
+    """Parse a $removeparam rule, or return None for anything else."""
+    line = line.strip()
+    if not line or line.startswith(('!', '[')) or '$' not in line:
+        return None
+    rule = ParamRule(line)
+    if line.startswith('@@'):
+        rule.exception = True
+        line = line[2:]
+    pattern, _, options = line.partition('$')
+    if pattern:
+        host = PLAIN_HOST_FILTER_RE.match(pattern.lower())
+        if not host:
+            return None
+        rule.host = host.group(1)
+    found = False
+    for option in options.split(','):
+        name, _, value = option.strip().partition('=')
+        if name == 'removeparam':
+            found = True
+            if value.startswith('~'):
+                return None
+            if len(value) > 2 and value.startswith('/') and value.endswith('/'):
+                try:
+                    rule.regex = re.compile(value[1:-1])
+                except re.error:
+                    return None
+            elif value:
+                rule.name = value
+        elif name == 'domain' and value:
+            include = {d for d in value.lower().split('|') if d and not d.startswith('~')}
+            exclude = {d[1:] for d in value.lower().split('|') if d.startswith('~')}
+            rule.include_domains = include or None
+            rule.exclude_domains = exclude or None
+        else:
+            return None
+    return rule if found else None
+
+class ParamFilters:
+    """Compiled $removeparam rules.
+
+    Unconditional rules for a plain parameter name, nearly all of them, are a
+    set lookup per parameter. Rules tied to a host are indexed by host and
+    found through the request host's suffixes.
+    """
+    def __init__(self):
+        self.generic_names = set()
+        self.generic = []
+        self.hosts = {}
+        # host -> exception rules, '' for the ones without a host
+        self.exceptions = {}
+
+    def add(self, rule):
+        if rule.exception:
+            self.exceptions.setdefault(rule.host or '', []).append(rule)
+        elif rule.host is not None:
+            self.hosts.setdefault(rule.host, []).append(rule)
+        elif (rule.name is not None and rule.include_domains is None
+              and rule.exclude_domains is None):
+            self.generic_names.add(rule.name)
+        else:
+            self.generic.append(rule)
+
+    def strip(self, url, host, first_party_host=''):
+        """Return ``url`` without its tracking parameters, or None if it has none."""
+        query_start = url.find('?')
+        if query_start == -1:
+            return None
+        query_end = url.find('#', query_start)
+        if query_end == -1:
+            query_end = len(url)
+        query = url[query_start + 1:query_end]
+        if not query:
+            return None
+        suffixes = host_suffixes(host) if host else []
+        rules = self.generic + [rule for s in suffixes for rule in self.hosts.get(s, ())]
+        exceptions = [rule for s in suffixes + [''] for rule in self.exceptions.get(s, ())]
+        kept = []
+        for pair in query.split('&'):
+            name = pair.split('=', 1)[0]
+            if ((name in self.generic_names
+                 or any(rule.applies(name, pair, first_party_host) for rule in rules))
+                    and not any(rule.applies(name, pair, first_party_host)
+                                for rule in exceptions)):
+                continue
+            kept.append(pair)
+        if len(kept) == query.count('&') + 1:
+            return None
+        stripped = url[:query_start]
+        if kept:
+            stripped += '?' + '&'.join(kept)
+        return stripped + url[query_end:]
+
+def compile_param_rules(text):
+    filters = ParamFilters()
+    for line in text.splitlines():
+        rule = parse_param_rule(line)
+        if rule is not None:
+            filters.add(rule)
+    return filters
+
+class TrackingParamStripper:
+    """Interceptor stage that redirects requests to their URL minus tracking parameters.
+
+    Without it Chromium caches, and history records, one copy of a page per
+    campaign link pointing at it.
+    """
+    name = "removeparam"
+
+    def __init__(self, rules_text=DEFAULT_PARAM_RULES, enabled=True):
+        self.filters = compile_param_rules(rules_text)
+        self.enabled = enabled
+        self.redirected = 0
+
+    def process(self, info):
+        if not self.enabled or info.requestMethod() != b"GET":
+            return False
+        url = info.requestUrl()
+        if url.scheme() not in NETWORK_SCHEMES:
+            return False
+        stripped = self.filters.strip(url.toString(QUrl.FullyEncoded), url.host(),
+                                      info.firstPartyUrl().host())
+        if stripped is None:
+            return False
+        self.redirected += 1
+        # the redirected request comes through the chain again, so later
+        # stages see the clean URL then
+        info.redirect(QUrl(stripped))
+        return True
+
+    def canonical(self, url):
+        """Return the form of ``url`` that goes into history and the completer."""
+        if not self.enabled or '?' not in url:
+            return url
+        qurl = QUrl(url)
+        if qurl.scheme() not in NETWORK_SCHEMES:
+            return url
+        stripped = self.filters.strip(url, qurl.host())
+        return url if stripped is None else stripped
+
+# a deliberately small sample of Chromium's HSTS preload list (the TLDs and
+# big sites typed most often), in the same JSON layout; Chromium's full
+# transport_security_state_static.json can replace it as is
+HSTS_PRELOAD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hsts_preload.json")
+# hosts where a failed HTTPS attempt would mostly mean a slow timeout
+LOCAL_HOSTS = ('localhost',)
+LOCAL_HOST_SUFFIXES = ('.local', '.lan', '.home', '.internal', '.localhost', '.localdomain')
+IPV4_RE = re.compile(r'^\d{1,3}(?:\.\d{1,3}){3}$')
+
+class HttpsUpgrader:
+    """HTTPS-first navigation.
+
+    Typed bare hosts are tried over HTTPS and fall back to HTTP if the load
+    fails. Hosts on the preload list are HTTPS-only, whether or not
+    HTTPS-first is on: typed navigations skip the fallback, and plain HTTP
+    requests to them are redirected by the interceptor stage before they go
+    out, saving the server's redirect.
+    """
+    name = "https-upgrade"
+
+    def __init__(self, preload_file=HSTS_PRELOAD_FILE, enabled=True):
+        self.enabled = enabled
+        # include_subdomains entries, matched by suffix
+        self.preload = DomainTrie()
+        self.preload_exact = set()
+        # hosts whose HTTPS attempt failed this session
+        self.http_only = set()
+        self.upgraded = 0
+        self.load_preload_list(preload_file)
+
+    def load_preload_list(self, preload_file):
+        try:
+            with open(preload_file, 'r', encoding='utf-8') as f:
+                # Chromium's copy carries // comment lines
+                text = ''.join(line for line in f if not line.lstrip().startswith('//'))
+            entries = json.loads(text)['entries']
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            print(f"Error loading HSTS preload list: {e}")
+            return
+        for entry in entries:
+            name = entry.get('name', '').lower()
+            # entries without force-https only pin keys
+            if not name or entry.get('mode') != 'force-https':
+                continue
+            if entry.get('include_subdomains'):
+                self.preload.add(name, 1)
+            else:
+                self.preload_exact.add(name)
+
+    def is_preloaded(self, host):
+        host = host.lower()
+        return host in self.preload_exact or bool(self.preload.match(host))
+
+    def process(self, info):
+        url = info.requestUrl()
+        if url.scheme() != 'http' or not self.is_preloaded(url.host()):
+            return False
+        url.setScheme('https')
+        if url.port() == 80:
+            url.setPort(-1)
+        self.upgraded += 1
+        info.redirect(url)
+        return True
+
+    def typed_url(self, query):
+        """Return ``(url, fallback)`` for a host typed without a scheme.
+
+        ``fallback`` is the HTTP URL to load if the HTTPS one fails, or None.
+        """
+        http_url = QUrl(f"http://{query}")
+        https_url = QUrl(f"https://{query}")
+        host = http_url.host().lower()
+        if self.is_preloaded(host):
+            return https_url, None
+        # an explicit port is usually a local dev server speaking plain HTTP
+        if (not self.enabled or host in self.http_only or IPV4_RE.match(host)
+                or host in LOCAL_HOSTS or host.endswith(LOCAL_HOST_SUFFIXES)
+                or http_url.port() not in (-1, 443)):
+            return http_url, None
+        return https_url, http_url
+
+class AdBlocker(QWebEngineUrlRequestInterceptor):
+    name = "adblock"
+
+    def __init__(self, parent=None, filter_lists=None, cache_file="adblocker_cache.bin",
+                 auto_refresh=True, policy=None):
+        super().__init__(parent)
+        self.engine = FilterEngine()
+        self.policy = policy or InterceptPolicy.from_settings()
+        self.auto_refresh = auto_refresh
+        if filter_lists is None:
+            subscriptions = load_subscriptions()
+            filter_lists = subscription_lists(subscriptions)
+            self.list_names = {s['flag']: s['name'] for s in subscriptions}
+        else:
+            self.list_names = dict(LIST_NAMES)
+        self.filter_lists = dict(filter_lists)
+        self.cache_file = cache_file
+        # caches written by earlier versions, read once and converted
+        self.legacy_cache_file = "adblocker_cache.json"
+        # ETag/Last-Modified per list URL, plus when the lists were last checked
+        self.metadata_file = os.path.splitext(cache_file)[0] + "_lists.json"
+        self.list_metadata = {}
         self.cache_duration = timedelta(days=7)
+        self.cache_updated = None
+        self.updater = None
+        self.refresh_pending = False
+        # list flags waiting for the updater thread to drop them
+        self.pending_drops = 0
+        # snapshot whose URL and cosmetic rules the updater thread still has
+        # to parse
+        self.pending_snapshot = None
+        # profiles carrying the generic element hiding sheet, and the sheet
+        # they were last given
+        self.profiles = []
+        self.generic_css = None
+        self.stats = BlockerStats(self.list_names)
         self.load_hosts()
     
     def load_hosts(self):
-        if self.is_cache_valid():
-            self.load_from_cache()
-        else:
-            self.load_ad_hosts()
-            self.load_tracker_hosts()
-            self.save_to_cache()
+        # start from the last good snapshot, however old, and refresh in the
+        # background instead of blocking startup on the download
+        pending_file = self.cache_file + ".new"
+        if os.path.exists(pending_file):
+            try:
+                os.replace(pending_file, self.cache_file)
+            except OSError as e:
+                print(f"Error installing pending filter cache: {e}")
+        try:
+            if os.path.exists(self.cache_file):
+                self.load_from_cache()
+            elif os.path.exists(self.legacy_cache_file):
+                self.load_from_json_cache()
+                # the converted engine is good even if it can't be written
+                # out; the conversion is simply retried next start
+                try:
+                    self.save_to_cache(last_updated=self.cache_updated)
+                except OSError as e:
+                    print(f"Error writing filter cache: {e}")
+            else:
+                self.load_fallback_hosts()
+        except (OSError, SnapshotError, json.JSONDecodeError, KeyError, ValueError) as e:
+            print(f"Error reading filter cache: {e}")
+            self.cache_updated = None
+            self.load_fallback_hosts()
+        if self.cache_updated is not None:
+            self.load_list_metadata()
+            # subscriptions removed or disabled since the snapshot was written
+            stale = 0
+            for url, metadata in self.list_metadata.items():
+                lists = metadata.get('lists', 0)
+                if self.filter_lists.get(lists) != url:
+                    stale |= lists
+            if stale:
+                self.drop_lists(stale)
+        if self.auto_refresh and not self.is_cache_valid():
+            self.refresh()
+        if self.pending_snapshot is not None:
+            self.start_updater(fetch=False)
+
+    def load_fallback_hosts(self):
+        engine = FilterEngine()
+        for lists, hosts in FALLBACK_HOSTS.items():
+            if lists in self.filter_lists:
+                engine.add_hosts(hosts, lists)
+        self.engine = engine
+
+    def refresh(self):
+        if self.updater is not None and self.updater.isRunning():
+            self.refresh_pending = True
+            return
+        if not self.filter_lists:
+            if self.pending_drops:
+                self.start_updater(fetch=False)
+            return
+        self.start_updater()
+
+    def start_updater(self, fetch=True):
+        self.updater = FilterListUpdater(self, self.filter_lists, self.pending_drops, fetch,
+                                         self.pending_snapshot)
+        self.pending_drops = 0
+        self.pending_snapshot = None
+        # the swap is a single attribute store, so do it straight from the
+        # worker; interceptRequest only ever sees the old or the new engine
+        self.updater.engine_ready.connect(self.set_engine, Qt.DirectConnection)
+        self.updater.finished.connect(self.updater_finished)
+        self.updater.start(QThread.LowPriority)
+
+    def updater_finished(self):
+        # subscriptions may have changed while the lists were downloading
+        stale = 0
+        for lists, url in self.updater.filter_lists.items():
+            if self.filter_lists.get(lists) != url:
+                stale |= lists
+        self.pending_drops |= stale
+        self.update_cosmetic_scripts()
+        if self.refresh_pending:
+            self.refresh_pending = False
+            self.refresh()
+        elif self.pending_drops:
+            self.start_updater(fetch=False)
+
+    def set_engine(self, engine):
+        self.engine = engine
+
+    def set_policy(self, policy):
+        self.policy = policy
+
+    def install_cosmetic_filters(self, profile):
+        self.profiles.append(profile)
+        self.generic_css = self.engine.cosmetic.generic_stylesheet()
+        self.set_generic_script(profile, self.generic_css)
+
+    def set_generic_script(self, profile, css):
+        scripts = profile.scripts()
+        old = scripts.findScript("pybrowse-cosmetic-generic")
+        if not old.isNull():
+            scripts.remove(old)
+        if css:
+            scripts.insert(cosmetic_script("pybrowse-cosmetic-generic", 'generic', css,
+                                           sub_frames=True))
+
+    def update_cosmetic_scripts(self):
+        # scripts belong to the GUI thread, so this runs once an update is
+        # finished rather than from set_engine
+        css = self.engine.cosmetic.generic_stylesheet()
+        if css == self.generic_css:
+            return
+        self.generic_css = css
+        for profile in self.profiles:
+            self.set_generic_script(profile, css)
+
+    def update_site_script(self, page, url):
+        """Give the page the element hiding rules for the document it is about to load."""
+        site_css, generic_css = self.engine.cosmetic.stylesheets(url.host())
+        scripts = page.scripts()
+        old = scripts.findScript("pybrowse-cosmetic-site")
+        if not old.isNull():
+            scripts.remove(old)
+        if generic_css is not None:
+            scripts.insert(cosmetic_script("pybrowse-cosmetic-site", 'site',
+                                           generic_css + site_css, replaces_generic=True))
+        elif site_css:
+            scripts.insert(cosmetic_script("pybrowse-cosmetic-site", 'site', site_css))
+
+    def set_subscriptions(self, subscriptions):
+        """Apply an edited subscription list without rebuilding the kept lists."""
+        filter_lists = subscription_lists(subscriptions)
+        self.list_names.clear()
+        self.list_names.update((s['flag'], s['name']) for s in subscriptions)
+        dropped = 0
+        for lists, url in self.filter_lists.items():
+            if filter_lists.get(lists) != url:
+                dropped |= lists
+        added = any(self.filter_lists.get(lists) != url for lists, url in filter_lists.items())
+        self.filter_lists = filter_lists
+        if dropped:
+            self.drop_lists(dropped)
+        if added:
+            self.refresh()
+
+    def drop_lists(self, lists):
+        """Queue the rules of these lists for removal on the updater thread."""
+        self.pending_drops |= lists
+        if self.updater is None or not self.updater.isRunning():
+            self.start_updater(fetch=False)
+
+    def verdict_cache_stats(self):
+        # counters reset whenever a new engine is swapped in
+        info = self.engine.verdict_cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max_size': info.maxsize,
+            'hit_rate': info.hits / lookups if lookups else 0.0,
+        }
     
-    def is_cache_valid(self):
-        if not os.path.exists(self.cache_file):
-            return False
+    def load_list_metadata(self):
+        if not os.path.exists(self.metadata_file):
+            return
         try:
-            with open(self.cache_file, 'r') as f:
-                cache = json.load(f)
-            last_updated = datetime.fromisoformat(cache['last_updated'])
-            return datetime.now() - last_updated < self.cache_duration
-        except (json.JSONDecodeError, KeyError, ValueError):
-            # invalid cache file, return False to trigger reload
+            with open(self.metadata_file, 'r') as f:
+                metadata = json.load(f)
+            self.list_metadata = metadata['lists']
+            # a round of 304s refreshes the cache without rewriting it
+            last_checked = datetime.fromisoformat(metadata['last_checked'])
+            self.cache_updated = max(self.cache_updated, last_checked)
+        except (OSError, json.JSONDecodeError, KeyError, ValueError) as e:
+            print(f"Error reading filter list metadata: {e}")
+            self.list_metadata = {}
+
+    def save_list_metadata(self, list_metadata, last_checked=None):
+        now = last_checked or datetime.now()
+        metadata = {'last_checked': now.isoformat(), 'lists': list_metadata}
+        tmp_file = self.metadata_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_file, self.metadata_file)
+        self.list_metadata = list_metadata
+        self.cache_updated = now
+
+    def is_cache_valid(self):
+        if self.cache_updated is None:
             return False
+        return datetime.now() - self.cache_updated < self.cache_duration
 
     def load_from_cache(self):
-        with open(self.cache_file, 'r') as f:
+        snapshot = HostSnapshot(self.cache_file)
+        # the host trie is mapped, not read, so requests can be checked
+        # against it right away; the rules follow from the updater thread
+        self.engine = FilterEngine.from_snapshot(snapshot, rules=False)
+        self.cache_updated = datetime.fromtimestamp(snapshot.last_updated)
+        self.pending_snapshot = snapshot
+
+    def load_from_json_cache(self):
+        with open(self.legacy_cache_file, 'r') as f:
             cache = json.load(f)
-        self.ad_hosts = set(cache['ad_hosts'])
-        self.tracker_hosts = set(cache['tracker_hosts'])
+        engine = FilterEngine()
+        engine.add_hosts(cache['ad_hosts'], AD_LIST)
+        engine.add_hosts(cache['tracker_hosts'], TRACKER_LIST)
+        # the oldest caches only carried the host lists
+        rules = []
+        for key, lists in (('ad_filters', AD_LIST), ('tracker_filters', TRACKER_LIST)):
+            for line in cache.get(key, []):
+                rule = parse_filter(line, lists)
+                if rule is not None:
+                    rules.append(rule)
+        engine.add_filters(rules)
+        self.engine = engine
+        self.cache_updated = datetime.fromisoformat(cache['last_updated'])
     
-    def save_to_cache(self):
-        cache = {
-            'last_updated': datetime.now().isoformat(),
-            'ad_hosts': list(self.ad_hosts),
-            'tracker_hosts': list(self.tracker_hosts)
-        }
-        with open(self.cache_file, 'w') as f:
-            json.dump(cache, f)
-
-    def load_ad_hosts(self):
-        url = "https://raw.githubusercontent.com/easylist/easylist/master/easylist/easylist_adservers.txt"
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                for line in response.text.splitlines():
-                    if line.startswith('||') and '^' in line:
-                        domain = line.split('^')[0][2:]
-                        self.ad_hosts.add(domain)
-            else:
-                print(f"Failed to fetch ad list. Status code: {response.status_code}")
-        except requests.RequestException as e:
-            print(f"Error fetching ad list: {e}")
-            self.ad_hosts.update([
-                'ads.google.com',
-                'googleadservices.com',
-                'doubleclick.net',
-            ])
-
-    def load_tracker_hosts(self):
-        url = "https://raw.githubusercontent.com/easylist/easylist/master/easyprivacy/easyprivacy_trackingservers.txt"
+    def save_to_cache(self, engine=None, last_updated=None):
+        engine = engine or self.engine
+        # write next to the old cache and rename, so a crash mid-write never
+        # leaves us without a last good snapshot
+        tmp_file = self.cache_file + ".tmp"
+        updated = last_updated or datetime.now()
+        write_snapshot(tmp_file, engine.host_entries(), engine.rule_entries(), updated.timestamp())
         try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                for line in response.text.splitlines():
-                    if line.startswith('||') and '^' in line:
-                        domain = line.split('^')[0][2:]
-                        self.tracker_hosts.add(domain)
-            else:
-                print(f"Failed to fetch tracker list. Status code: {response.status_code}")
-        except requests.RequestException as e:
-            print(f"Error fetching tracker list: {e}")
-            self.tracker_hosts.update([
-                'analytics.google.com',
-                'facebook.com',
-                'tracking.example.com',
-            ])
+            os.replace(tmp_file, self.cache_file)
+        except PermissionError:
+            # Windows refuses to replace a file that is still mapped; the
+            # snapshot is picked up on the next launch instead
+            os.replace(tmp_file, self.cache_file + ".new")
+        self.cache_updated = updated
 
     def interceptRequest(self, info):
-        url = info.requestUrl()
-        if self.should_block_ad(url) or self.should_block_tracker(url):
-            info.block(True)
+        self.process(info)
 
-    def should_block_ad(self, url):
-        host = url.host()
-        # direct lookup first (fastest)
-        if host in self.ad_hosts:
-            return True
-        # check parent domains
-        return any(host.endswith('.' + ad_host) for ad_host in self.ad_hosts)
-
-    def should_block_tracker(self, url):
+    def process(self, info):
+        """Block the request if the filters say so; returns True when blocked."""
+        start = time.perf_counter_ns()
+        url = info.requestUrl()
+        resource_type = info.resourceType()
+        type_bit = RESOURCE_TYPE_BITS.get(resource_type, TYPE_OTHER)
+        policy = self.policy
+        skipped = policy.skip(url, resource_type, info.navigationType())
+        if skipped is not None:
+            self.stats.record(0, type_bit, '', '', time.perf_counter_ns() - start, skipped)
+            return False
         host = url.host()
-        # direct lookup first (fastest)
-        if host in self.tracker_hosts:
-            return True
-        # check parent domains
-        return any(host.endswith('.' + tracker_host) for tracker_host in self.tracker_hosts)
+        first_party_host = info.firstPartyUrl().host()
+        check_urls = policy.checks_urls(host, first_party_host)
+        # take one reference so a concurrent swap can't change engines mid-check
+        engine = self.engine
+        lists = engine.match(url.toString(), host, first_party_host, type_bit, check_urls)
+        if lists:
+            info.block(True)
+        self.stats.record(lists, type_bit, host, first_party_host,
+                          time.perf_counter_ns() - start,
+                          None if check_urls else SKIP_SAME_SITE)
+        return bool(lists)
+
+    def should_block_ad(self, url, first_party_url=None, resource_type=None):
+        first_party_host = first_party_url.host() if first_party_url is not None else ''
+        type_bit = RESOURCE_TYPE_BITS.get(resource_type, TYPE_OTHER)
+        return bool(self.engine.match(url.toString(), url.host(), first_party_host,
+                                      type_bit) & AD_LIST)
+
+    def should_block_tracker(self, url, first_party_url=None, resource_type=None):
+        first_party_host = first_party_url.host() if first_party_url is not None else ''
+        type_bit = RESOURCE_TYPE_BITS.get(resource_type, TYPE_OTHER)
+        return bool(self.engine.match(url.toString(), url.host(), first_party_host,
+                                      type_bit) & TRACKER_LIST)
 
 # TODO: This new tab overhaul is very sloppy. I don't feel like this code is super polished and there are probably some gaping holes I'm too tired to fix, or even spot. Maybe in some future version I'll go over this code again
 class ScrollableTabBar(QtWidgets.QTabBar):
@@ -1050,6 +2146,17 @@ class TabWidget(QtWidgets.QTabWidget):
         if action:
             self.setCurrentIndex(action.data())
 
+class FilteredWebEnginePage(QWebEnginePage):
+    """Page that picks up the site's element hiding rules before each navigation."""
+    def __init__(self, profile, parent=None, ad_blocker=None):
+        super().__init__(profile, parent)
+        self.ad_blocker = ad_blocker
+
+    def acceptNavigationRequest(self, url, navigation_type, is_main_frame):
+        if is_main_frame and self.ad_blocker is not None:
+            self.ad_blocker.update_site_script(self, url)
+        return super().acceptNavigationRequest(url, navigation_type, is_main_frame)
+
 class CustomWebEnginePage(QtWebEngineWidgets.QWebEnginePage):
     console_message = QtCore.pyqtSignal(str)
 
@@ -1057,7 +2164,7 @@ class CustomWebEnginePage(QtWebEngineWidgets.QWebEnginePage):
         self.console_message.emit(f"Console: {message} (line: {line}, source: {source})")
 
 class BrowserTab(QWebEngineView):
-    def __init__(self, url="https://www.google.com", profile=None, parent=None):
+    def __init__(self, url="https://www.google.com", profile=None, parent=None, ad_blocker=None):
         super().__init__(parent)
         self.reader_mode_active = False
         self.original_html = None
@@ -1068,8 +2175,10 @@ class BrowserTab(QWebEngineView):
             QWebEngineSettings.LocalStorageEnabled, True
         )
         self.image_url = None
+        # plain HTTP URL to retry if an HTTPS-first navigation fails
+        self.https_fallback_url = None
         self.profile = profile or QWebEngineProfile.defaultProfile()
-        self.web_page = QWebEnginePage(self.profile, self)
+        self.web_page = FilteredWebEnginePage(self.profile, self, ad_blocker)
         self.setPage(self.web_page)
         self.setUrl(QUrl(url))
         self.web_page.setLifecycleState(QWebEnginePage.LifecycleState.Active)
@@ -1293,10 +2402,10 @@ class BrowserTab(QWebEngineView):
         super().closeEvent(event)
 
 class PrivateBrowserTab(BrowserTab):
-    def __init__(self, url="https://www.google.com", profile=None, parent=None):
-        super().__init__(url, profile, parent)
+    def __init__(self, url="https://www.google.com", profile=None, parent=None, ad_blocker=None):
+        super().__init__(url, profile, parent, ad_blocker)
         self.profile = profile or QWebEngineProfile(None)
-        self.page = QWebEnginePage(self.profile, self)
+        self.page = FilteredWebEnginePage(self.profile, self, ad_blocker)
         self.web_page.settings().setAttribute(QWebEngineSettings.LocalStorageEnabled, False)
         self.web_page.settings().setAttribute(QWebEngineSettings.JavascriptEnabled, True)
         self.setPage(self.page)
@@ -1323,16 +2432,1069 @@ class PrivateBrowserTab(BrowserTab):
     def closeEvent(self, event):
         super().closeEvent(event)
 
+HISTORY_DB_FILE = "history.db"
+HISTORY_PAGE_SIZE = 200
+HISTORY_SEARCH_CANDIDATES = 2000
+HISTORY_SEARCH_DEBOUNCE_MS = 200
+COMPLETER_HISTORY_LIMIT = 5000
+
+class HistoryStore:
+    """Browsing history in SQLite.
+
+    ``urls`` holds one row per distinct URL with its title and visit count,
+    ``visits`` one row per navigation. A visit is an upsert plus an insert,
+    whatever the size of the history, and reads go through paging queries
+    so nothing ever loads the whole table.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS urls (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL UNIQUE,
+            host TEXT NOT NULL DEFAULT '',
+            title TEXT NOT NULL DEFAULT '',
+            visit_count INTEGER NOT NULL DEFAULT 0,
+            last_visit REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS visits (
+            id INTEGER PRIMARY KEY,
+            url_id INTEGER NOT NULL REFERENCES urls(id) ON DELETE CASCADE,
+            visit_time REAL NOT NULL,
+            typed INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE INDEX IF NOT EXISTS urls_host ON urls(host);
+        CREATE INDEX IF NOT EXISTS urls_last_visit ON urls(last_visit);
+        CREATE INDEX IF NOT EXISTS visits_time ON visits(visit_time, id);
+        CREATE INDEX IF NOT EXISTS visits_url ON visits(url_id);
+    """
+    # external content table, so titles and URLs are not stored twice; the
+    # update trigger only fires for title changes, not for every visit
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS urls_fts USING fts5(
+            title, url, content='urls', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS urls_fts_insert AFTER INSERT ON urls BEGIN
+            INSERT INTO urls_fts (rowid, title, url) VALUES (new.id, new.title, new.url);
+        END;
+        CREATE TRIGGER IF NOT EXISTS urls_fts_delete AFTER DELETE ON urls BEGIN
+            INSERT INTO urls_fts (urls_fts, rowid, title, url)
+            VALUES ('delete', old.id, old.title, old.url);
+        END;
+        CREATE TRIGGER IF NOT EXISTS urls_fts_update AFTER UPDATE OF title, url ON urls BEGIN
+            INSERT INTO urls_fts (urls_fts, rowid, title, url)
+            VALUES ('delete', old.id, old.title, old.url);
+            INSERT INTO urls_fts (rowid, title, url) VALUES (new.id, new.title, new.url);
+        END;
+    """
+
+    def __init__(self, path="history.db"):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent across crashes; NORMAL only risks
+        # the last few visits on power loss, not corruption
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(self.SCHEMA)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(visits)")]
+        if 'typed' not in columns:
+            self.db.execute("ALTER TABLE visits ADD COLUMN typed INTEGER NOT NULL DEFAULT 0")
+        self.has_fts = self.create_fts()
+        self.db.commit()
+
+    def create_fts(self):
+        """Set up the full-text index, or return False if SQLite lacks FTS5."""
+        try:
+            self.db.executescript(self.FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"History search falls back to LIKE: {e}")
+            return False
+        # databases from before the index existed need it filled once
+        if not self.db.execute("SELECT 1 FROM meta WHERE key = 'fts_built'").fetchone():
+            self.db.execute("INSERT INTO urls_fts (urls_fts) VALUES ('rebuild')")
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('fts_built', '1')")
+        return True
+
+    def close(self):
+        self.db.close()
+
+    def add_visit(self, url, title='', visit_time=None, commit=True, typed=False):
+        visit_time = visit_time or time.time()
+        host = QUrl(url).host().lower()
+        self.db.execute(
+            """INSERT INTO urls (url, host, title, visit_count, last_visit)
+               VALUES (?, ?, ?, 1, ?)
+               ON CONFLICT(url) DO UPDATE SET
+                   visit_count = visit_count + 1,
+                   last_visit = MAX(last_visit, excluded.last_visit),
+                   title = CASE WHEN excluded.title != '' THEN excluded.title ELSE title END""",
+            (url, host, title or '', visit_time))
+        url_id = self.db.execute("SELECT id FROM urls WHERE url = ?", (url,)).fetchone()[0]
+        self.db.execute("INSERT INTO visits (url_id, visit_time, typed) VALUES (?, ?, ?)",
+                        (url_id, visit_time, int(typed)))
+        if commit:
+            self.db.commit()
+
+    def set_title(self, url, title):
+        self.db.execute("UPDATE urls SET title = ? WHERE url = ?", (title, url))
+        self.db.commit()
+
+    def entry(self, row):
+        url, title, visit_time = row[:3]
+        return {
+            'url': url,
+            'title': title or url,
+            'timestamp': datetime.fromtimestamp(visit_time).isoformat(),
+        }
+
+    def visits(self, limit=HISTORY_PAGE_SIZE, before=None):
+        """Return up to ``limit`` visits, newest first, and the cursor for the next page.
+
+        ``before`` is the cursor returned with the previous page; paging on
+        (time, id) instead of OFFSET keeps deep pages as cheap as the first.
+        """
+        query = """SELECT urls.url, urls.title, visits.visit_time, visits.id
+                     FROM visits JOIN urls ON urls.id = visits.url_id"""
+        params = ()
+        if before is not None:
+            query += " WHERE (visits.visit_time, visits.id) < (?, ?)"
+            params = tuple(before)
+        query += " ORDER BY visits.visit_time DESC, visits.id DESC LIMIT ?"
+        rows = self.db.execute(query, params + (limit,)).fetchall()
+        cursor = (rows[-1][2], rows[-1][3]) if len(rows) == limit else None
+        return [self.entry(row) for row in rows], cursor
+
+    def iter_visits(self, batch=1000):
+        cursor = None
+        while True:
+            entries, cursor = self.visits(batch, cursor)
+            yield from entries
+            if cursor is None:
+                return
+
+    def search(self, text, limit=HISTORY_PAGE_SIZE):
+        """Return the URLs matching every word of ``text``, best match first.
+
+        Each word matches as a prefix of a word in the title or URL, and
+        titles weigh more than URLs in the ranking. Text matching more than
+        HISTORY_SEARCH_CANDIDATES URLs is not ranked: the newest URLs that
+        contain every word are returned instead, which keeps one or two
+        typed letters from scoring the whole history. Without FTS5, or for
+        text with no words in it, this is a substring search instead.
+        """
+        words = re.findall(r'\w+', text.lower())
+        if self.has_fts and words:
+            query = ' '.join('"' + word + '"*' for word in words)
+            # counting stops one past the limit, so common words cost no more
+            # than rare ones
+            matches = self.db.execute(
+                """SELECT count(*) FROM (
+                       SELECT rowid FROM urls_fts WHERE urls_fts MATCH ? LIMIT ?
+                   )""", (query, HISTORY_SEARCH_CANDIDATES + 1)).fetchone()[0]
+            if matches > HISTORY_SEARCH_CANDIDATES:
+                return self.search_recent(words, limit)
+            rows = self.db.execute(
+                """SELECT urls.url, urls.title, urls.last_visit
+                   FROM urls_fts JOIN urls ON urls.id = urls_fts.rowid
+                   WHERE urls_fts MATCH ?
+                   ORDER BY bm25(urls_fts, 2.0, 1.0), urls.last_visit DESC
+                   LIMIT ?""", (query, limit)).fetchall()
+            return [self.entry(row) for row in rows]
+        return self.search_like(text, limit)
+
+    def search_recent(self, words, limit=HISTORY_PAGE_SIZE):
+        """Return the newest URLs containing every one of ``words``.
+
+        The scan walks urls_last_visit and stops at ``limit`` rows, which is
+        quick for words common enough to need it.
+        """
+        clauses, args = [], []
+        for word in words:
+            clauses.append("(url LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\')")
+            args += ['%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'] * 2
+        rows = self.db.execute(
+            """SELECT url, title, last_visit FROM urls
+               WHERE """ + ' AND '.join(clauses) + """
+               ORDER BY last_visit DESC LIMIT ?""", args + [limit]).fetchall()
+        return [self.entry(row) for row in rows]
+
+    def search_like(self, text, limit=HISTORY_PAGE_SIZE):
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = self.db.execute(
+            """SELECT url, title, last_visit FROM urls
+               WHERE url LIKE ? ESCAPE '\\' OR title LIKE ? ESCAPE '\\'
+               ORDER BY last_visit DESC LIMIT ?""", (pattern, pattern, limit)).fetchall()
+        return [self.entry(row) for row in rows]
+
+    def recent_visits(self, limit=COMPLETER_HISTORY_LIMIT, sample=10):
+        """Return {url: (visit count, [(visit time, typed), ...])} for frecency.
+
+        Covers the ``limit`` most recently visited URLs, with at most the
+        ``sample`` newest visits of each.
+        """
+        rows = self.db.execute(
+            """SELECT recent.url, recent.visit_count, visits.visit_time, visits.typed
+               FROM (SELECT id, url, visit_count FROM urls
+                     ORDER BY last_visit DESC LIMIT ?) AS recent
+               JOIN visits ON visits.id IN (
+                   SELECT id FROM visits WHERE url_id = recent.id
+                   ORDER BY visit_time DESC LIMIT ?)""", (limit, sample))
+        result = {}
+        for url, visit_count, visit_time, typed in rows:
+            result.setdefault(url, (visit_count, []))[1].append((visit_time, bool(typed)))
+        return result
+
+    def last_url(self):
+        row = self.db.execute(
+            """SELECT urls.url FROM visits JOIN urls ON urls.id = visits.url_id
+               ORDER BY visits.visit_time DESC, visits.id DESC LIMIT 1""").fetchone()
+        return row[0] if row else None
+
+    def visit_count(self):
+        return self.db.execute("SELECT COUNT(*) FROM visits").fetchone()[0]
+
+    def clear(self):
+        self.db.execute("DELETE FROM visits")
+        self.db.execute("DELETE FROM urls")
+        self.db.commit()
+
+    def import_json(self, path):
+        """Move the entries of an old history.json in, once."""
+        if not os.path.exists(path):
+            return 0
+        if self.db.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+            return 0
+        try:
+            with open(path, 'r') as f:
+                history_data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error reading {path}: {e}")
+            return 0
+        imported = 0
+        now = time.time()
+        with self.db:
+            for entry in history_data:
+                if isinstance(entry, str):
+                    entry = {'url': entry, 'title': entry}
+                if not isinstance(entry, dict) or not entry.get('url'):
+                    continue
+                try:
+                    visit_time = datetime.fromisoformat(entry['timestamp']).timestamp()
+                except (KeyError, ValueError, TypeError):
+                    visit_time = now
+                self.add_visit(entry['url'], entry.get('title', ''), visit_time, commit=False)
+                imported += 1
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)",
+                            (datetime.now().isoformat(),))
+        # keep the old file around rather than delete anybody's history
+        try:
+            os.replace(path, path + ".imported")
+        except OSError as e:
+            print(f"Error renaming {path}: {e}")
+        return imported
+
+# (age in days, weight) of a visit; older visits weigh FRECENCY_OLD_WEIGHT
+FRECENCY_BUCKETS = ((4, 100), (14, 70), (31, 50), (90, 30))
+FRECENCY_OLD_WEIGHT = 10
+# bonuses in percent of the bucket weight
+FRECENCY_LINK_BONUS = 100
+FRECENCY_TYPED_BONUS = 200
+FRECENCY_BOOKMARK_BONUS = 75
+FRECENCY_SAMPLE = 10
+# more candidates than this and top() walks the ranking instead
+FRECENCY_CANDIDATE_LIMIT = 500
+# how far down the ranking a query made only of broad words is followed
+FRECENCY_SCAN_LIMIT = 2000
+URL_TOKEN_RE = re.compile(r'[^\W_]+')
+
+def url_tokens(url):
+    """The lowered words of a URL's host and path, without the scheme."""
+    lowered = url.lower()
+    return tuple(URL_TOKEN_RE.findall(lowered.split('://', 1)[-1]))
+
+class FrecencyRanker:
+    """Scores URLs by how often and how recently they were visited.
+
+    A URL's score is its visit count times the average weight of its last
+    FRECENCY_SAMPLE visits. A visit weighs more the newer it is, more
+    again if the address was typed, and bookmarked URLs get a bonus on
+    every visit. Scores are kept up to date as visits come in, along with
+    a list of all URLs ordered by score. Since the weights depend on age,
+    everything is rescored once a day.
+
+    Queries match URLs whose host and path words start with each word of
+    the query. The words are indexed once, lowered, when a URL is first
+    seen: a sorted vocabulary finds the words with a given prefix and
+    postings map them to URLs, so a narrow query only looks at its own
+    matches. Every narrow word of the query is looked up this way and the
+    sets are intersected, smallest first. When all the words are broad (a
+    letter or two), their postings would gather most of the history, so
+    the ranking is walked instead: it stops at the first k matches, which
+    come early precisely because the words are broad, or after
+    FRECENCY_SCAN_LIMIT URLs.
+    """
+    def __init__(self):
+        self.visits = {}  # url -> [visit count, [(time, typed), ...]]
+        self.bookmarked = set()
+        self.scores = {}
+        self.ranked = []  # (-score, url), best first
+        self.scored_day = None
+        self.tokens = {}  # url -> its words, each behind a space
+        self.postings = {}  # word -> urls
+        self.vocabulary = []
+
+    def load(self, recent_visits, bookmarks=(), now=None):
+        """Replace everything, from HistoryStore.recent_visits() and bookmark URLs."""
+        self.visits = {
+            url: [visit_count, sorted(visits)[-FRECENCY_SAMPLE:]]
+            for url, (visit_count, visits) in recent_visits.items()
+        }
+        self.bookmarked = set(bookmarks)
+        self.rescore(now)
+
+    def rescore(self, now=None):
+        now = now or time.time()
+        urls = set(self.visits) | self.bookmarked
+        self.scores = {url: self.score(url, now) for url in urls}
+        self.ranked = sorted((-score, url) for url, score in self.scores.items())
+        self.scored_day = int(now // 86400)
+        if urls != set(self.tokens):
+            self.tokens = {}
+            self.postings = {}
+            for url in urls:
+                self.index(url, False)
+            self.vocabulary = sorted(self.postings)
+
+    def index(self, url, keep_sorted=True):
+        words = url_tokens(url)
+        # one string, so matches() is a few substring tests in C
+        self.tokens[url] = ' ' + ' '.join(words)
+        for word in words:
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = set()
+                if keep_sorted:
+                    bisect.insort(self.vocabulary, word)
+            posting.add(url)
+
+    def score(self, url, now):
+        bonus = FRECENCY_BOOKMARK_BONUS if url in self.bookmarked else 0
+        visit_count, visits = self.visits.get(url, (0, ()))
+        if not visits:
+            # a bookmark nobody visited yet still ranks like a recent link
+            return FRECENCY_BUCKETS[0][1] * bonus / 100
+        points = 0
+        for visit_time, typed in visits:
+            age = (now - visit_time) / 86400
+            weight = FRECENCY_OLD_WEIGHT
+            for days, bucket_weight in FRECENCY_BUCKETS:
+                if age <= days:
+                    weight = bucket_weight
+                    break
+            points += weight * ((FRECENCY_TYPED_BONUS if typed else FRECENCY_LINK_BONUS) + bonus) / 100
+        return visit_count * points / len(visits)
+
+    def update(self, url, now):
+        old = self.scores.get(url)
+        if old is not None:
+            index = bisect.bisect_left(self.ranked, (-old, url))
+            if index < len(self.ranked) and self.ranked[index] == (-old, url):
+                del self.ranked[index]
+        else:
+            self.index(url)
+        score = self.score(url, now)
+        self.scores[url] = score
+        bisect.insort(self.ranked, (-score, url))
+
+    def add_visit(self, url, visit_time=None, typed=False):
+        visit_time = visit_time or time.time()
+        entry = self.visits.setdefault(url, [0, []])
+        entry[0] += 1
+        entry[1].append((visit_time, typed))
+        del entry[1][:-FRECENCY_SAMPLE]
+        self.update(url, visit_time)
+
+    def set_bookmarked(self, url, bookmarked=True):
+        if bookmarked:
+            self.bookmarked.add(url)
+        else:
+            self.bookmarked.discard(url)
+        self.update(url, time.time())
+
+    def candidates(self, prefix):
+        """URLs with a word starting with ``prefix``, or None if there are too many."""
+        vocabulary = self.vocabulary
+        result = set()
+        for i in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+            word = vocabulary[i]
+            if not word.startswith(prefix):
+                break
+            posting = self.postings[word]
+            if len(posting) > FRECENCY_CANDIDATE_LIMIT:
+                return None
+            result |= posting
+            if len(result) > FRECENCY_CANDIDATE_LIMIT:
+                return None
+        return result
+
+    def matches(self, url, prefixes):
+        tokens = self.tokens[url]
+        for prefix in prefixes:
+            if prefix not in tokens:
+                return False
+        return True
+
+    def top(self, query, k=5):
+        """Return the ``k`` best scored URLs matching every word of ``query``."""
+        now = time.time()
+        if self.scored_day != int(now // 86400):
+            self.rescore(now)
+        # split like the indexed URLs, so a pasted https://... still matches
+        words = url_tokens(query)
+        if not words:
+            return []
+        prefixes = [' ' + word for word in words]
+        narrow = []
+        for word in words:
+            found = self.candidates(word)
+            if found is not None:
+                if not found:
+                    return []
+                narrow.append(found)
+        if narrow:
+            narrow.sort(key=len)
+            candidates = narrow[0]
+            for found in narrow[1:]:
+                candidates = candidates & found
+            scores = self.scores
+            # the broad words, if any, are checked against each candidate
+            return heapq.nsmallest(
+                k, (url for url in candidates if self.matches(url, prefixes)),
+                key=lambda url: (-scores[url], url))
+        matches = []
+        for scanned, (_, url) in enumerate(self.ranked):
+            if scanned == FRECENCY_SCAN_LIMIT:
+                break
+            if self.matches(url, prefixes):
+                matches.append(url)
+                if len(matches) == k:
+                    break
+        return matches
+
+class CompletionModel(QtCore.QAbstractListModel):
+    """Rows of the URL bar popup.
+
+    set_rows() only touches the rows that changed, so a visit or a new
+    suggestion updates the open popup in place instead of resetting it.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self.rows[index.row()]
+        return None
+
+    def set_rows(self, rows):
+        old, new = self.rows, list(rows)
+        common = min(len(old), len(new))
+        changed = [i for i in range(common) if old[i] != new[i]]
+        if changed:
+            old[:common] = new[:common]
+            self.dataChanged.emit(self.index(changed[0]), self.index(changed[-1]))
+        if len(new) > len(old):
+            self.beginInsertRows(QtCore.QModelIndex(), len(old), len(new) - 1)
+            old.extend(new[len(old):])
+            self.endInsertRows()
+        elif len(new) < len(old):
+            self.beginRemoveRows(QtCore.QModelIndex(), len(new), len(old) - 1)
+            del old[len(new):]
+            self.endRemoveRows()
+
+SUGGESTION_CACHE_SIZE = 256
+SUGGESTION_CACHE_TTL = 600  # seconds
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+class SuggestionCache:
+    """Recent online suggestions, keyed by engine and normalised query.
+
+    Entries expire after ``ttl`` seconds and the least recently used one
+    goes once ``max_size`` is reached. prefix() answers a query that was
+    never asked from the longest cached query it extends, by keeping the
+    suggestions that still start with it; that fills the popup while the
+    real answer is on its way.
+    """
+    def __init__(self, max_size=SUGGESTION_CACHE_SIZE, ttl=SUGGESTION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = {}  # (engine, query) -> (expires, suggestions), oldest first
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    def lookup(self, key, now):
+        entry = self.entries.pop(key, None)
+        if entry is None or entry[0] <= now:
+            return None
+        # reinserting moves the entry to the recently used end
+        self.entries[key] = entry
+        return entry[1]
+
+    def get(self, engine, query):
+        suggestions = self.lookup((engine, normalize_query(query)), time.monotonic())
+        if suggestions is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(suggestions)
+
+    def prefix(self, engine, query):
+        query = normalize_query(query)
+        now = time.monotonic()
+        for length in range(len(query) - 1, 0, -1):
+            suggestions = self.lookup((engine, query[:length]), now)
+            if suggestions is not None:
+                self.prefix_hits += 1
+                return [s for s in suggestions if s.lower().startswith(query)]
+        return None
+
+    def put(self, engine, query, suggestions):
+        key = (engine, normalize_query(query))
+        self.entries.pop(key, None)
+        while len(self.entries) >= self.max_size:
+            del self.entries[next(iter(self.entries))]
+        self.entries[key] = (time.monotonic() + self.ttl, tuple(suggestions))
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'prefix_hits': self.prefix_hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+SUGGESTION_DEBOUNCE_MS = 150
+SUGGESTION_MAX_IN_FLIGHT = 2
+SUGGESTION_DEADLINE_MS = 800
+SUGGESTION_LATENCY_SAMPLES = 500
+SUGGESTION_LIMIT = 10
+# OpenSearch suggestion endpoints for the engines in the settings dialog;
+# each can be overridden with suggestions/endpoints/<engine>
+SUGGESTION_ENDPOINTS = {
+    "Google": "https://suggestqueries.google.com/complete/search?client=firefox&q={query}",
+    "Bing": "https://api.bing.com/osjson.aspx?query={query}",
+    "DuckDuckGo": "https://duckduckgo.com/ac/?q={query}&type=list",
+    "Yandex": "https://suggest.yandex.com/suggest-ff.cgi?part={query}",
+}
+
+def query_words(query):
+    return URL_TOKEN_RE.findall(query.lower())
+
+def matches_words(words, text):
+    """True if every word starts one of the words of ``text``."""
+    tokens = ' ' + ' '.join(URL_TOKEN_RE.findall(text.lower()))
+    return all(' ' + word in tokens for word in words)
+
+def merge_suggestions(groups, limit=SUGGESTION_LIMIT):
+    """Concatenate provider answers in provider order, without duplicates.
+
+    The order only depends on the providers, never on which one answered
+    first, so the popup does not reshuffle while answers come in.
+    """
+    merged = {}
+    for suggestions in groups:
+        for suggestion in suggestions:
+            merged.setdefault(normalize_query(suggestion), suggestion)
+            if len(merged) == limit:
+                return list(merged.values())
+    return list(merged.values())
+
+class SuggestionProvider:
+    """Something that completes the URL bar.
+
+    Local providers answer at once from suggest(). Remote ones answer
+    through SuggestionScheduler instead and have nothing to say here.
+    """
+    name = ""
+    limit = 5
+
+    def suggest(self, query):
+        return []
+
+class TabSuggestions(SuggestionProvider):
+    """Pages open in other tabs."""
+    name = "tabs"
+    limit = 3
+
+    def __init__(self, open_pages):
+        self.open_pages = open_pages
+
+    def suggest(self, query):
+        words = query_words(query)
+        if not words:
+            return []
+        return [url for url, title in self.open_pages()
+                if matches_words(words, url + ' ' + title)][:self.limit]
+
+class HistorySuggestions(SuggestionProvider):
+    """The most frecent matching URLs."""
+    name = "history"
+    limit = 5
+
+    def __init__(self, frecency):
+        self.frecency = frecency
+
+    def suggest(self, query):
+        return self.frecency.top(query, self.limit)
+
+class BookmarkSuggestions(SuggestionProvider):
+    """Bookmarks whose title or address matches."""
+    name = "bookmarks"
+    limit = 3
+
+    def __init__(self, bookmarks):
+        self.bookmarks = bookmarks
+
+    def suggest(self, query):
+        words = query_words(query)
+        if not words:
+            return []
+        matches = []
+        for entry in self.bookmarks():
+            if isinstance(entry, dict) and entry.get('url') and \
+                    matches_words(words, entry['url'] + ' ' + entry.get('title', '')):
+                matches.append(entry['url'])
+                if len(matches) == self.limit:
+                    break
+        return matches
+
+class RemoteSuggestions(SuggestionProvider):
+    """A search engine's OpenSearch suggestion endpoint, fetched by SuggestionScheduler."""
+    limit = 8
+
+    def __init__(self, name, url_template):
+        self.name = name
+        self.url_template = url_template
+
+    def request(self, query):
+        return QNetworkRequest(QUrl(self.url_template.format(query=quote(query))))
+
+    def parse(self, data):
+        """Read an OpenSearch answer, ``[query, [suggestion, ...], ...]``."""
+        payload = json.loads(data.decode('utf-8'))
+        if not (isinstance(payload, list) and len(payload) >= 2
+                and isinstance(payload[1], list)):
+            raise ValueError("not an OpenSearch suggestion list")
+        return [s for s in payload[1] if isinstance(s, str)][:self.limit]
+
+def remote_suggestion_providers(search_engine):
+    """The engines asked for suggestions: suggestions/remote_engines, or the search engine.
+
+    Each engine's endpoint can be overridden in suggestions/endpoints/<name>.
+    "Custom" has no built-in endpoint, only the one set next to the custom
+    search URL in the settings dialog; without it there are no online
+    suggestions.
+    """
+    settings = QtCore.QSettings("PyBrowse", "PyBrowse")
+    names = [name.strip() for name in
+             settings.value("suggestions/remote_engines", "", str).split(',') if name.strip()]
+    providers = []
+    for name in names or [search_engine]:
+        template = settings.value(f"suggestions/endpoints/{name}",
+                                  SUGGESTION_ENDPOINTS.get(name, ""), str)
+        if template:
+            providers.append(RemoteSuggestions(name, template))
+    return providers
+
+class SuggestionScheduler(QtCore.QObject):
+    """Decides when remote suggestions are fetched and which answers are shown.
+
+    Keystrokes restart a debounce timer, so a burst of typing sends one
+    round of requests, one per remote provider, all at once. Each answer is
+    shown as soon as it arrives, so a fast provider never waits for a slow
+    one. The round closes when every provider answered or when the deadline
+    runs out; answers after that are late, cached but not shown.
+    Each keystroke also bumps a generation number, and only answers for
+    the latest generation are shown, so a slow reply to an older query
+    never replaces a newer one. Each provider may have ``max_in_flight``
+    requests running, past that its oldest is aborted.
+
+    The time from a keystroke to the first real answer shown for it is
+    recorded, for tuning the debounce.
+    """
+    suggestions_ready = pyqtSignal(str, object)  # query, {provider name: suggestions}
+
+    def __init__(self, network_manager, cache=None, parent=None,
+                 debounce_ms=SUGGESTION_DEBOUNCE_MS, max_in_flight=SUGGESTION_MAX_IN_FLIGHT,
+                 deadline_ms=SUGGESTION_DEADLINE_MS):
+        super().__init__(parent)
+        self.network_manager = network_manager
+        self.cache = cache or SuggestionCache()
+        self.providers = []
+        self.max_in_flight = max_in_flight
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce_ms)
+        self.timer.timeout.connect(self.fetch)
+        self.deadline = QTimer(self)
+        self.deadline.setSingleShot(True)
+        self.deadline.setInterval(deadline_ms)
+        self.deadline.timeout.connect(self.finish)
+        self.generation = 0
+        self.answered = 0
+        self.timed = 0  # the generation whose latency was recorded
+        self.query = ""
+        self.typed_at = 0.0
+        self.results = {}
+        self.interim = {}  # provider name -> suggestions for a shorter query
+        self.last_shown = None
+        self.missing = []
+        self.pending = set()
+        self.in_flight = []  # (reply, generation, provider), oldest first
+        self.latencies = []  # ms, the most recent SUGGESTION_LATENCY_SAMPLES
+        self.requests = 0
+        self.aborted = 0
+        self.stale = 0
+        self.late = 0
+
+    def load_settings(self):
+        settings = QtCore.QSettings("PyBrowse", "PyBrowse")
+        self.timer.setInterval(settings.value("suggestions/debounce_ms", SUGGESTION_DEBOUNCE_MS, int))
+        self.deadline.setInterval(settings.value("suggestions/deadline_ms", SUGGESTION_DEADLINE_MS, int))
+        self.max_in_flight = max(1, settings.value("suggestions/max_in_flight",
+                                                   SUGGESTION_MAX_IN_FLIGHT, int))
+
+    def set_providers(self, providers):
+        self.cancel()
+        self.providers = list(providers)
+
+    def keystroke(self, query):
+        self.generation += 1
+        self.query = query
+        self.typed_at = time.perf_counter()
+        self.timer.stop()
+        self.deadline.stop()
+        self.results = {}
+        self.interim = {}
+        self.last_shown = None
+        self.missing = []
+        for provider in self.providers:
+            cached = self.cache.get(provider.url_template, query)
+            if cached is None:
+                self.missing.append(provider)
+            else:
+                self.results[provider.name] = cached
+        if not self.missing:
+            if self.providers:
+                self.finish()
+            return
+        # narrowed down from a shorter query until the real answers are in
+        for provider in self.missing:
+            partial = self.cache.prefix(provider.url_template, query)
+            if partial:
+                self.interim[provider.name] = partial
+        if self.interim or self.results:
+            self.show(self.shown())
+        self.timer.start()
+
+    def shown(self):
+        """The answers in so far, with interim ones for providers still out."""
+        shown = {name: suggestions for name, suggestions in self.interim.items()
+                 if name not in self.results}
+        shown.update(self.results)
+        return shown
+
+    def show(self, shown):
+        # the deadline often has nothing to add to what the answers showed
+        if shown != self.last_shown:
+            self.last_shown = shown
+            self.suggestions_ready.emit(self.query, shown)
+        # interim answers belong to a shorter query and don't count
+        if self.results and self.timed != self.generation:
+            self.timed = self.generation
+            self.latencies.append((time.perf_counter() - self.typed_at) * 1000)
+            del self.latencies[:-SUGGESTION_LATENCY_SAMPLES]
+
+    def cancel(self):
+        """Forget the current query, e.g. when the URL bar was emptied."""
+        self.generation += 1
+        self.timer.stop()
+        self.deadline.stop()
+        while self.in_flight:
+            reply = self.in_flight.pop(0)[0]
+            self.aborted += 1
+            reply.abort()
+
+    def fetch(self):
+        generation, query = self.generation, self.query
+        self.pending = set()
+        for provider in self.missing:
+            while True:
+                running = [entry for entry in self.in_flight if entry[2] is provider]
+                if len(running) < self.max_in_flight:
+                    break
+                self.in_flight.remove(running[0])
+                self.aborted += 1
+                running[0][0].abort()
+            reply = self.network_manager.get(provider.request(query))
+            self.in_flight.append((reply, generation, provider))
+            self.pending.add(provider.name)
+            self.requests += 1
+            reply.finished.connect(partial(self.reply_finished, reply, generation, query, provider))
+        self.deadline.start()
+
+    def reply_finished(self, reply, generation, query, provider):
+        try:
+            if (reply, generation, provider) in self.in_flight:
+                self.in_flight.remove((reply, generation, provider))
+            suggestions = None
+            if reply.error() == QNetworkReply.NoError:
+                # an exception escaping a slot aborts the whole browser, so a
+                # malformed body only costs this provider's answer
+                try:
+                    suggestions = provider.parse(bytes(reply.readAll()))
+                except (ValueError, IndexError, KeyError, TypeError) as e:
+                    print(f"Suggestion error from {provider.name}: {e}")
+                else:
+                    self.cache.put(provider.url_template, query, suggestions)
+            if generation != self.generation:
+                self.stale += 1
+                return
+            if generation == self.answered:
+                self.late += 1
+                return
+            if suggestions is not None:
+                self.results[provider.name] = suggestions
+            self.pending.discard(provider.name)
+            if not self.pending:
+                self.finish()
+            elif suggestions is not None:
+                self.show(self.shown())
+        finally:
+            reply.deleteLater()
+
+    def finish(self):
+        """Close the round; providers still out are dropped and count as late."""
+        self.deadline.stop()
+        if self.answered == self.generation:
+            return
+        self.answered = self.generation
+        self.show(dict(self.results))
+
+    def stats(self):
+        samples = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+        return {
+            'requests': self.requests,
+            'aborted': self.aborted,
+            'stale': self.stale,
+            'late': self.late,
+            'in_flight': len(self.in_flight),
+            'debounce_ms': self.timer.interval(),
+            'deadline_ms': self.deadline.interval(),
+            'max_in_flight': self.max_in_flight,
+            'latency_ms': {
+                'samples': len(samples),
+                'p50': percentile(0.50),
+                'p90': percentile(0.90),
+                'p99': percentile(0.99),
+            },
+            'cache': self.cache.stats(),
+        }
+
+JOURNAL_WRITE_DELAY = 0.25  # seconds of changes written and fsynced together
+JOURNAL_COMPACT_RECORDS = 500
+HISTORY_WRITES = "history"
+
+def apply_bookmark_record(bookmarks, record):
+    if record.get('op') == 'add' and record['entry'] not in bookmarks:
+        bookmarks.append(record['entry'])
+
+class Journal:
+    """A JSON snapshot plus an append-only log of the changes made since.
+
+    Loading replays the log over the snapshot, dropping a line that was
+    torn by a crash. Once the log gets long it is folded back into a new
+    snapshot. ``apply`` must be idempotent: a crash between replacing the
+    snapshot and truncating the log replays records already in it.
+    Everything but load() runs on the persistence thread.
+    """
+    def __init__(self, path, apply):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.apply = apply
+        self.state = []
+        self.records = 0
+        self.file = None
+
+    def load(self):
+        state = []
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    state = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Error reading {self.path}: {e}")
+        records = 0
+        if os.path.exists(self.journal_path):
+            good = 0
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError("incomplete record")
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    self.apply(state, record)
+                    good += len(line)
+                    records += 1
+            if good < os.path.getsize(self.journal_path):
+                # cut the torn tail off, or new records would land behind it
+                with open(self.journal_path, 'r+b') as f:
+                    f.truncate(good)
+        self.state = list(state)
+        self.records = records
+        return state
+
+    def append(self, records):
+        if self.file is None:
+            self.file = open(self.journal_path, 'a', encoding='utf-8')
+        for record in records:
+            self.file.write(json.dumps(record) + '\n')
+            self.apply(self.state, record)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records += len(records)
+        if self.records >= JOURNAL_COMPACT_RECORDS:
+            self.compact()
+
+    def compact(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.close()
+        open(self.journal_path, 'w').close()
+        self.records = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class PersistenceThread(QThread):
+    """Writes bookmarks and history to disk off the GUI thread.
+
+    Changes are queued from the GUI thread and written in batches: the
+    first change starts a short timer, everything queued until it runs out
+    goes to disk together, with one fsync per journal and one SQLite
+    transaction for the visits.
+    """
+    def __init__(self, parent=None, history_path=HISTORY_DB_FILE):
+        super().__init__(parent)
+        self.history_path = history_path
+        self.journals = {}
+        self.tasks = queue.Queue()
+
+    def add_journal(self, name, journal):
+        self.journals[name] = journal
+
+    def append(self, name, record):
+        self.tasks.put((name, record))
+
+    def add_visit(self, url, title, visit_time, typed=False):
+        self.tasks.put((HISTORY_WRITES, (url, title, visit_time, typed)))
+
+    def stop(self):
+        """Write out whatever is still queued and wait for the thread."""
+        if self.isRunning():
+            self.tasks.put(None)
+            self.wait()
+
+    def run(self):
+        history = HistoryStore(self.history_path)
+        running = True
+        while running:
+            batch = [self.tasks.get()]
+            deadline = time.monotonic() + JOURNAL_WRITE_DELAY
+            while batch[-1] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.tasks.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                running = False
+            self.write(batch, history)
+        for name, journal in self.journals.items():
+            try:
+                if journal.records:
+                    journal.compact()
+            except OSError as e:
+                print(f"Error compacting {name}: {e}")
+            journal.close()
+        history.close()
+
+    def write(self, batch, history):
+        records = {}
+        visits = []
+        for name, item in batch:
+            if name == HISTORY_WRITES:
+                visits.append(item)
+            else:
+                records.setdefault(name, []).append(item)
+        for name, items in records.items():
+            try:
+                self.journals[name].append(items)
+            except OSError as e:
+                print(f"Error writing {name}: {e}")
+        if visits:
+            try:
+                with history.db:
+                    for url, title, visit_time, typed in visits:
+                        history.add_visit(url, title, visit_time, commit=False, typed=typed)
+            except sqlite3.Error as e:
+                print(f"Error saving history: {e}")
+
 class HistoryPage(QtWidgets.QWidget):
-    def __init__(self, history):
+    history_cleared = pyqtSignal()
+
+    def __init__(self, history_store):
         super().__init__()
-        self.history_data = history
+        self.history_store = history_store
+        self.history_model = HistoryModel(history_store, self)
         self.empty_state = None
         self.setStyleSheet("""
             HistoryPage {
                 background-color: #f8f9fa;
             }
-            QListWidget {
+            QListView {
                 background: white;
                 border: 1px solid #e9ecef;
                 border-radius: 8px;
@@ -1359,9 +3521,9 @@ class HistoryPage(QtWidgets.QWidget):
         dialog.setDefaultButton(QtWidgets.QMessageBox.No)
         
         if dialog.exec_() == QtWidgets.QMessageBox.Yes:
-            self.history_data.clear()
-            self.load_history(self.history_data)
-            self.update_empty_state()
+            self.history_store.clear()
+            self.history_model.reload()
+            self.history_cleared.emit()
     
     def export_history(self):
         path, _ = QtWidgets.QFileDialog.getSaveFileName(
@@ -1372,7 +3534,7 @@ class HistoryPage(QtWidgets.QWidget):
                 with open(path, 'w', newline='', encoding='utf-8') as f:
                     writer = csv.writer(f)
                     writer.writerow(['Timestamp', 'Title', 'URL'])
-                    for entry in self.history_data:
+                    for entry in self.history_store.iter_visits():
                         writer.writerow([
                             entry.get('timestamp', ''),
                             entry.get('title', ''),
@@ -1406,24 +3568,34 @@ class HistoryPage(QtWidgets.QWidget):
         self.search_bar = QtWidgets.QLineEdit()
         self.search_bar.setPlaceholderText("Search history...")
         self.search_bar.addAction(QtGui.QIcon(":/icons/search.svg"), QtWidgets.QLineEdit.LeadingPosition)
-        self.search_bar.textChanged.connect(self.filter_history)
+        # search once typing pauses, not on every keystroke
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(HISTORY_SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.filter_history)
+        self.search_bar.textChanged.connect(lambda text: self.search_timer.start())
         main_layout.addWidget(self.search_bar)
 
-        self.history_list = QtWidgets.QListWidget()
+        self.history_list = QtWidgets.QListView()
         self.history_list.setStyleSheet("""
-            QListWidget::item {
+            QListView::item {
                 border-bottom: 1px solid #e9ecef;
                 padding: 4px;
             }
-            QListWidget::item:hover {
+            QListView::item:hover {
                 background-color: #f8f9fa;
             }
-            QListWidget::item:selected {
+            QListView::item:selected {
                 background-color: #e7f5ff;
                 border-radius: 4px;
             }
         """)
         self.history_list.setAlternatingRowColors(True)
+        # every row has the same height, which spares the view from asking
+        # the delegate about each one
+        self.history_list.setUniformItemSizes(True)
+        self.history_list.setModel(self.history_model)
+        self.history_list.setItemDelegate(HistoryItemDelegate(self.history_list))
         main_layout.addWidget(self.history_list)
 
         control_layout = QtWidgets.QHBoxLayout()
@@ -1501,102 +3673,133 @@ class HistoryPage(QtWidgets.QWidget):
         self.empty_state.setLayout(empty_layout)
         main_layout.addWidget(self.empty_state)
 
-        self.load_history(self.history_data)
-
-    def load_history(self, history):
-        self.history_list.clear()
-        # iterate in reverse without creating a copy
-        for i in range(len(history) - 1, -1, -1):
-            entry = history[i]
-            item = QtWidgets.QListWidgetItem()
-            widget = HistoryItemWidget(entry)
-            item.setSizeHint(widget.sizeHint())
-            self.history_list.addItem(item)
-            self.history_list.setItemWidget(item, widget)
+        self.history_model.modelReset.connect(self.update_empty_state)
+        self.history_model.rowsInserted.connect(self.update_empty_state)
         self.update_empty_state()
 
     def update_empty_state(self):
-        self.empty_state.setVisible(self.history_list.count() == 0)
-
-    def filter_history(self, text):
-        search_text = text.lower()
-        for i in range(self.history_list.count()):
-            item = self.history_list.item(i)
-            widget = self.history_list.itemWidget(item)
-            if widget and hasattr(widget, 'entry'):
-                entry = widget.entry
-                # combine checks for efficiency
-                is_match = (search_text in entry.get('url', '').lower() or 
-                           search_text in entry.get('title', '').lower())
-                item.setHidden(not is_match)
-
-
-class HistoryItemWidget(QtWidgets.QWidget):
-    def __init__(self, entry):
-        super().__init__()
-        self.entry = entry
-        self.init_ui()
+        self.empty_state.setVisible(self.history_model.rowCount() == 0)
 
-    def init_ui(self):
-        layout = QtWidgets.QHBoxLayout()
-        layout.setContentsMargins(8, 8, 8, 8)
-        layout.setSpacing(16)
+    def filter_history(self):
+        self.history_model.reload(self.search_bar.text().strip())
 
-        self.favicon = QtWidgets.QLabel()
-        self.favicon.setFixedSize(16, 16)
-        self.load_favicon()
-        layout.addWidget(self.favicon)
 
-        text_layout = QtWidgets.QVBoxLayout()
-        text_layout.setSpacing(4)
-        
-        title = self.entry.get('title', 'No Title')
-        self.title_label = QtWidgets.QLabel()
-        self.set_elided_text(self.title_label, title, QtCore.Qt.ElideRight, 250)
-        
-        url = self.entry.get('url', 'about:blank')
-        self.url_label = QtWidgets.QLabel()
-        self.set_elided_text(self.url_label, url, QtCore.Qt.ElideMiddle, 350)
-        
-        text_layout.addWidget(self.title_label)
-        text_layout.addWidget(self.url_label)
-        layout.addLayout(text_layout, 1)
+def format_history_time(timestamp):
+    try:
+        return datetime.fromisoformat(timestamp).strftime("%b %d, %H:%M")
+    except (ValueError, TypeError):
+        return "Recent"
 
-        self.time_label = QtWidgets.QLabel(self.format_time())
-        self.time_label.setStyleSheet("color: #868e96; font-size: 13px;")
-        layout.addWidget(self.time_label)
+class HistoryModel(QtCore.QAbstractListModel):
+    """Visits for the history page, read from the store a page at a time.
 
-        self.setLayout(layout)
+    The view asks for the next page through canFetchMore()/fetchMore() when
+    it is scrolled near the end. A search replaces the rows with the
+    matches of the full-text index.
+    """
+    UrlRole = QtCore.Qt.UserRole
+    TimeRole = QtCore.Qt.UserRole + 1
 
-    def set_elided_text(self, label, text, mode, width):
-        metrics = QtGui.QFontMetrics(label.font())
-        elided = metrics.elidedText(text, mode, width)
-        label.setText(elided)
-        label.setToolTip(text)
-        label.setStyleSheet("""
-            QLabel {
-                color: %s;
-                font-size: %s;
-                font-weight: %s;
-            }
-        """ % (
-            "#212529" if label == self.title_label else "#868e96",
-            "14px" if label == self.title_label else "13px",
-            "500" if label == self.title_label else "400"
-        ))
-
-    def format_time(self):
-        timestamp = self.entry.get('timestamp', '')
-        try:
-            dt = datetime.fromisoformat(timestamp)
-            return dt.strftime("%b %d, %H:%M")
-        except (ValueError, TypeError):
-            return "Recent"
+    def __init__(self, history_store, parent=None):
+        super().__init__(parent)
+        self.history_store = history_store
+        self.entries = []
+        self.next_page = None
+        self.search_text = ""
+        self.reload()
+
+    def reload(self, search_text=None):
+        if search_text is not None:
+            self.search_text = search_text
+        self.beginResetModel()
+        if self.search_text:
+            self.entries = self.history_store.search(self.search_text)
+            self.next_page = None
+        else:
+            self.entries, self.next_page = self.history_store.visits()
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.next_page is not None
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        entries, self.next_page = self.history_store.visits(before=self.next_page)
+        if entries:
+            first = len(self.entries)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(entries) - 1)
+            self.entries.extend(entries)
+            self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.entries[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return entry['title']
+        if role in (self.UrlRole, QtCore.Qt.ToolTipRole):
+            return entry['url']
+        if role == self.TimeRole:
+            return format_history_time(entry['timestamp'])
+        return None
+
+class HistoryItemDelegate(QtWidgets.QStyledItemDelegate):
+    """Paints a history row: favicon, title over URL, and the visit time."""
+    ROW_HEIGHT = 56
 
-    def load_favicon(self):
-        pixmap = QtGui.QPixmap(":/icons/globe.svg").scaled(16, 16,
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.favicon = QtGui.QPixmap(":/icons/globe.svg").scaled(16, 16,
                     QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
-        self.favicon.setPixmap(pixmap)
+        self.title_font = QtGui.QFont()
+        self.title_font.setPixelSize(14)
+        self.title_font.setWeight(QtGui.QFont.Medium)
+        self.small_font = QtGui.QFont()
+        self.small_font.setPixelSize(13)
+        self.title_metrics = QtGui.QFontMetrics(self.title_font)
+        self.small_metrics = QtGui.QFontMetrics(self.small_font)
+
+    def sizeHint(self, option, index):
+        return QtCore.QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def paint(self, painter, option, index):
+        option = QtWidgets.QStyleOptionViewItem(option)
+        self.initStyleOption(option, index)
+        option.text = ""
+        # the background, hover and selection from the view's stylesheet
+        style = option.widget.style() if option.widget else QtWidgets.QApplication.style()
+        style.drawPrimitive(QtWidgets.QStyle.PE_PanelItemViewItem, option, painter, option.widget)
+
+        rect = option.rect.adjusted(12, 8, -12, -8)
+        painter.save()
+        painter.drawPixmap(rect.left(), rect.center().y() - 8, self.favicon)
+
+        time_text = index.data(HistoryModel.TimeRole) or ""
+        time_width = self.small_metrics.horizontalAdvance(time_text)
+        painter.setFont(self.small_font)
+        painter.setPen(QtGui.QColor("#868e96"))
+        painter.drawText(QtCore.QRect(rect.right() - time_width, rect.top(), time_width, rect.height()),
+                         QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter, time_text)
+
+        text_left = rect.left() + 32
+        text_width = max(0, rect.right() - time_width - 16 - text_left)
+        half = rect.height() // 2
+        url = index.data(HistoryModel.UrlRole) or "about:blank"
+        painter.drawText(QtCore.QRect(text_left, rect.top() + half, text_width, half),
+                         QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter,
+                         self.small_metrics.elidedText(url, QtCore.Qt.ElideMiddle, text_width))
+
+        title = index.data(QtCore.Qt.DisplayRole) or "No Title"
+        painter.setFont(self.title_font)
+        painter.setPen(QtGui.QColor("#212529"))
+        painter.drawText(QtCore.QRect(text_left, rect.top(), text_width, half),
+                         QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter,
+                         self.title_metrics.elidedText(title, QtCore.Qt.ElideRight, text_width))
+        painter.restore()
 
 class SettingsDialog(QtWidgets.QDialog):
     settings_changed = QtCore.pyqtSignal()
@@ -1729,9 +3932,53 @@ class SettingsDialog(QtWidgets.QDialog):
         self.custom_search_engine_input.setPlaceholderText("Enter custom search URL...")
         search_engine_layout.addWidget(self.custom_search_engine_input)
 
+        self.custom_suggestion_input = QtWidgets.QLineEdit()
+        self.custom_suggestion_input.setPlaceholderText(
+            "Enter custom suggestion URL with {query} (optional)...")
+        search_engine_layout.addWidget(self.custom_suggestion_input)
+
         search_engine_group.setLayout(search_engine_layout)
         self.layout.addWidget(search_engine_group)
 
+        subscriptions_group = QtWidgets.QGroupBox("Filter Subscriptions")
+        subscriptions_layout = QtWidgets.QVBoxLayout()
+
+        # checked lists are compiled into the blocker, unchecked ones are kept
+        # here so they can be turned back on
+        self.subscriptions_list = QtWidgets.QListWidget()
+        self.subscriptions_list.setMinimumHeight(120)
+        subscriptions_layout.addWidget(self.subscriptions_list)
+
+        self.subscription_name_input = QtWidgets.QLineEdit()
+        self.subscription_name_input.setPlaceholderText("List name (optional)")
+        subscriptions_layout.addWidget(self.subscription_name_input)
+        self.subscription_url_input = QtWidgets.QLineEdit()
+        self.subscription_url_input.setPlaceholderText("Enter filter list URL...")
+        self.subscription_url_input.returnPressed.connect(self.add_subscription)
+        subscriptions_layout.addWidget(self.subscription_url_input)
+
+        subscription_buttons = QtWidgets.QHBoxLayout()
+        add_subscription_btn = QtWidgets.QPushButton("Add")
+        add_subscription_btn.clicked.connect(self.add_subscription)
+        remove_subscription_btn = QtWidgets.QPushButton("Remove")
+        remove_subscription_btn.clicked.connect(self.remove_subscription)
+        subscription_buttons.addWidget(add_subscription_btn)
+        subscription_buttons.addWidget(remove_subscription_btn)
+        subscription_buttons.addStretch()
+        subscriptions_layout.addLayout(subscription_buttons)
+
+        self.skip_main_frame_toggle = StyledCheckBox("Never block top-level pages")
+        subscriptions_layout.addWidget(self.skip_main_frame_toggle)
+        self.same_site_toggle = StyledCheckBox("Skip generic URL rules for a site's own requests")
+        subscriptions_layout.addWidget(self.same_site_toggle)
+        self.strip_params_toggle = StyledCheckBox("Remove tracking parameters from URLs")
+        subscriptions_layout.addWidget(self.strip_params_toggle)
+        self.https_first_toggle = StyledCheckBox("Try HTTPS first for typed addresses")
+        subscriptions_layout.addWidget(self.https_first_toggle)
+
+        subscriptions_group.setLayout(subscriptions_layout)
+        self.layout.addWidget(subscriptions_group)
+
         experimental_group = QtWidgets.QGroupBox("Experiments")
         experimental_layout = QtWidgets.QVBoxLayout()
 
@@ -1769,38 +4016,130 @@ class SettingsDialog(QtWidgets.QDialog):
         index = self.search_engine_combo.findText(search_engine)
         self.search_engine_combo.setCurrentIndex(index)
         self.custom_search_engine_input.setText(custom_search)
+        self.custom_suggestion_input.setText(settings.value("suggestions/endpoints/Custom", "", str))
         experimental_tab_style = settings.value("experimental/tab_style", False, bool)
         self.tab_style_toggle.setChecked(experimental_tab_style)
+        self.subscriptions_list.clear()
+        for subscription in load_subscriptions():
+            self.add_subscription_item(subscription)
+        policy = InterceptPolicy.from_settings()
+        self.skip_main_frame_toggle.setChecked(policy.skip_main_frame)
+        self.same_site_toggle.setChecked(policy.same_site_host_rules_only)
+        self.strip_params_toggle.setChecked(
+            settings.value("privacy/strip_tracking_params", True, bool))
+        self.https_first_toggle.setChecked(settings.value("privacy/https_first", True, bool))
+
+    def add_subscription_item(self, subscription):
+        item = QtWidgets.QListWidgetItem(subscription['name'])
+        item.setToolTip(subscription['url'])
+        item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+        item.setCheckState(QtCore.Qt.Checked if subscription.get('enabled', True)
+                           else QtCore.Qt.Unchecked)
+        item.setData(QtCore.Qt.UserRole, subscription)
+        self.subscriptions_list.addItem(item)
+
+    def subscriptions(self):
+        subscriptions = []
+        for i in range(self.subscriptions_list.count()):
+            item = self.subscriptions_list.item(i)
+            subscription = dict(item.data(QtCore.Qt.UserRole))
+            subscription['enabled'] = item.checkState() == QtCore.Qt.Checked
+            subscriptions.append(subscription)
+        return subscriptions
+
+    def add_subscription(self):
+        url = self.subscription_url_input.text().strip()
+        if not url:
+            return
+        if QUrl(url).scheme() not in ('http', 'https'):
+            QtWidgets.QMessageBox.warning(self, "Invalid URL",
+                                          "Filter lists must be http or https URLs.")
+            return
+        subscriptions = self.subscriptions()
+        if any(subscription['url'] == url for subscription in subscriptions):
+            QtWidgets.QMessageBox.information(self, "Filter Subscriptions",
+                                              "This list is already subscribed.")
+            return
+        subscription = new_subscription(subscriptions,
+                                        self.subscription_name_input.text().strip(), url)
+        if subscription is None:
+            QtWidgets.QMessageBox.warning(
+                self, "Filter Subscriptions",
+                f"At most {MAX_SUBSCRIPTIONS} filter lists can be subscribed."
+            )
+            return
+        self.add_subscription_item(subscription)
+        self.subscription_name_input.clear()
+        self.subscription_url_input.clear()
+
+    def remove_subscription(self):
+        for item in self.subscriptions_list.selectedItems():
+            self.subscriptions_list.takeItem(self.subscriptions_list.row(item))
 
     def save_settings(self):
         settings = QtCore.QSettings("PyBrowse", "PyBrowse")
         settings.setValue("search_engine", self.search_engine_combo.currentText())
         settings.setValue("custom_search_engine", self.custom_search_engine_input.text())
+        settings.setValue("suggestions/endpoints/Custom", self.custom_suggestion_input.text().strip())
         settings.setValue("experimental/tab_style", self.tab_style_toggle.isChecked())
+        save_subscriptions(self.subscriptions())
+        settings.setValue("adblock/skip_main_frame", self.skip_main_frame_toggle.isChecked())
+        settings.setValue("adblock/same_site_host_rules_only", self.same_site_toggle.isChecked())
+        settings.setValue("privacy/strip_tracking_params", self.strip_params_toggle.isChecked())
+        settings.setValue("privacy/https_first", self.https_first_toggle.isChecked())
         self.settings_changed.emit()
 
 class PyBrowse(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
         self.network_manager = QNetworkAccessManager(self)
-        self.current_search_reply = None
+        self.suggestion_scheduler = SuggestionScheduler(self.network_manager, SuggestionCache(), self)
+        self.suggestion_scheduler.suggestions_ready.connect(self.show_online_suggestions)
+        self.online_suggestions = {}
         self.suppress_autocomplete = False
         self.create_menu_bar()
         self.setWindowTitle("PyBrowse")
         self.setGeometry(100, 100, 1024, 768)
         self.bookmarks_file = "bookmarks.json"
         self.history_file = "history.json"
+        self.history_store = HistoryStore(HISTORY_DB_FILE)
+        self.frecency = FrecencyRanker()
+        # local providers, in the order their answers are listed; remote
+        # engines come after them and are set up in load_user_settings
+        self.suggestion_providers = [
+            TabSuggestions(self.open_pages),
+            HistorySuggestions(self.frecency),
+            BookmarkSuggestions(lambda: self.bookmarks),
+        ]
+        self.persistence = PersistenceThread(self, HISTORY_DB_FILE)
+        self.bookmark_journal = Journal(self.bookmarks_file, apply_bookmark_record)
+        self.persistence.add_journal("bookmarks", self.bookmark_journal)
+        self.last_history_url = None
         self.is_private_mode = False
         self.search_engine = "Google"
         self.custom_search_engine = ""
         self.bookmarks = []
-        self.history = []
-        self.local_urls = []  # cache for completer performance
         self.is_fullscreen = False
         self.default_profile = QWebEngineProfile.defaultProfile()
         self.default_profile.setPersistentCookiesPolicy(QWebEngineProfile.ForcePersistentCookies)
         self.private_profile = QWebEngineProfile("private")
         self.private_profile.setPersistentCookiesPolicy(QWebEngineProfile.NoPersistentCookies)
+        self.ad_blocker = AdBlocker(self)
+        self.param_stripper = TrackingParamStripper(
+            enabled=QtCore.QSettings("PyBrowse", "PyBrowse").value(
+                "privacy/strip_tracking_params", True, bool))
+        self.https_upgrader = HttpsUpgrader(
+            enabled=QtCore.QSettings("PyBrowse", "PyBrowse").value("privacy/https_first", True, bool))
+        # one interceptor per profile is all Qt allows, so every request
+        # filter is a stage of this chain
+        self.interceptors = InterceptorChain(self)
+        # blocking first: no point cleaning up a request that gets dropped
+        self.interceptors.add_stage(self.ad_blocker)
+        self.interceptors.add_stage(self.https_upgrader)
+        self.interceptors.add_stage(self.param_stripper)
+        for profile in (self.default_profile, self.private_profile):
+            profile.setUrlRequestInterceptor(self.interceptors)
+            self.ad_blocker.install_cosmetic_filters(profile)
         self.central_widget = QtWidgets.QWidget(self)
         self.setCentralWidget(self.central_widget)
         self.layout = QtWidgets.QVBoxLayout(self.central_widget)
@@ -1808,24 +4147,22 @@ class PyBrowse(QtWidgets.QMainWindow):
         self.layout.setContentsMargins(0, 0, 0, 0)
         self.tabs = TabWidget(self)
         self.layout.addWidget(self.tabs)
-        self.completer_model = QtCore.QStringListModel()
+        self.completer_model = CompletionModel(self)
         self.completer = QCompleter(self.completer_model, self) 
         self.completer.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         self.create_navigation_bar()
         self.layout.addWidget(self.navigation_bar)
         self.tabs.currentChanged.connect(self.activate_current_tab)
         self.url_bar.setCompleter(self.completer)
-        self.url_bar.textEdited.connect(self.fetch_search_suggestions)
         self.load_bookmarks()
         self.load_history()
+        self.persistence.start(QThread.LowPriority)
         self.load_user_settings()
-        self.update_completer_model()
+        self.reload_completions()
         self.download_manager = DownloadManager()
         self.add_new_tab("https://www.google.com")
         self.create_fullscreen_toggle()
-        self.search_timer = QtCore.QTimer()
-        self.search_timer.setSingleShot(True)
-        self.search_timer.timeout.connect(self.fetch_search_suggestions)
         self.setStyleSheet("""
             QMainWindow {
                 background: #ffffff;
@@ -1846,7 +4183,9 @@ class PyBrowse(QtWidgets.QMainWindow):
     
     def handle_text_changes(self):
         if not self.url_bar.text():
-            self.completer_model.setStringList([])
+            self.suggestion_scheduler.cancel()
+            self.online_suggestions = {}
+            self.completer_model.set_rows([])
             self.url_bar.setPlaceholderText("Search or enter address")
     
     def activate_current_tab(self, index):
@@ -1856,6 +4195,12 @@ class PyBrowse(QtWidgets.QMainWindow):
 
     def handle_settings_change(self):
         self.load_user_settings()
+        self.ad_blocker.set_subscriptions(load_subscriptions())
+        self.ad_blocker.set_policy(InterceptPolicy.from_settings())
+        self.param_stripper.enabled = QtCore.QSettings("PyBrowse", "PyBrowse").value(
+            "privacy/strip_tracking_params", True, bool)
+        self.https_upgrader.enabled = QtCore.QSettings("PyBrowse", "PyBrowse").value(
+            "privacy/https_first", True, bool)
         tab_bar = self.tabs.tabBar()
         if isinstance(tab_bar, ScrollableTabBar):
             tab_bar.apply_style_settings()
@@ -1870,76 +4215,61 @@ class PyBrowse(QtWidgets.QMainWindow):
             self.tabs.repaint()
     
     
-    def update_completer_model(self):
+    def reload_completions(self):
+        """Rebuild the completion index from scratch, after startup or a bulk change."""
         try:
-            # use set comprehension for better performance
-            url_set = {
-                entry.get('url', '') 
-                for entry in self.history + self.bookmarks
+            # canonical forms, so links that only differ in tracking
+            # parameters show up once
+            canonical = self.param_stripper.canonical
+            bookmarks = {
+                canonical(entry['url']) for entry in self.bookmarks
                 if isinstance(entry, dict) and entry.get('url')
             }
-            # remove empty strings and convert to sorted list
-            self.local_urls = sorted([url for url in url_set if url])
-            self.completer_model.setStringList(self.local_urls)
-            
-            # force completer refresh
-            self.completer.complete()
-        except Exception as e:
+            # only the most recent part of the history, which may be huge
+            self.frecency.load(
+                self.history_store.recent_visits(COMPLETER_HISTORY_LIMIT, FRECENCY_SAMPLE),
+                bookmarks)
+        except sqlite3.Error as e:
             print(f"Completer error: {e}")
+        self.refresh_completions()
+
+    def refresh_completions(self):
+        """Bring the popup rows up to date with the index, in place."""
+        query = self.url_bar.text().strip()
+        if not query:
+            return
+        groups = [provider.suggest(query) for provider in self.suggestion_providers]
+        groups.extend(self.online_suggestions.get(provider.name, [])
+                      for provider in self.suggestion_scheduler.providers)
+        self.completer_model.set_rows(merge_suggestions(groups))
+
+    def open_pages(self):
+        """(url, title) of the pages open in browser tabs, for tab suggestions."""
+        pages = []
+        for i in range(self.tabs.count()):
+            tab = self.tabs.widget(i)
+            if isinstance(tab, BrowserTab):
+                pages.append((tab.url().toString(), tab.page().title()))
+        return pages
 
     
     def fetch_search_suggestions(self):
-        try:
-            query = self.url_bar.text().strip()
-            if not query:
-                self.handle_text_changes()
-                return
-            
-            self.url_bar.setPlaceholderText("Search or enter address")
-            
-            # optimize local search by using cached urls
-            query_lower = query.lower()
-            local_matches = [
-                url for url in self.local_urls
-                if query_lower in url.lower()
-            ][:5]
-            
-            self.completer_model.setStringList(local_matches)
-            
-            if self.current_search_reply:
-                self.current_search_reply.abort()
-            
-            url = QUrl("https://suggestqueries.google.com/complete/search")
-            query_params = QUrlQuery()
-            query_params.addQueryItem("client", "firefox")
-            query_params.addQueryItem("q", query)
-            url.setQuery(query_params)
-            
-            request = QNetworkRequest(url)
-            self.current_search_reply = self.network_manager.get(request)
-            self.current_search_reply.finished.connect(
-                lambda: self.handle_online_suggestions(self.current_search_reply, query)
-            )
-            
-        except Exception as e:
-            print(f"Search error: {e}")
+        query = self.url_bar.text().strip()
+        if not query:
+            self.handle_text_changes()
+            return
+        
+        self.url_bar.setPlaceholderText("Search or enter address")
+        
+        # local matches right away, online ones once the scheduler has them
+        self.online_suggestions = {}
+        self.refresh_completions()
+        self.suggestion_scheduler.keystroke(query)
     
-    def handle_online_suggestions(self, reply, original_query):
-        try:
-            if reply.error() == QNetworkReply.NoError:
-                data = bytes(reply.readAll()).decode('utf-8')
-                online_suggestions = json.loads(data)[1]
-                
-                current = self.completer_model.stringList()
-                combined = list(set(current + online_suggestions))[:10]
-                
-                self.completer_model.setStringList(combined)
-                self.completer.complete()
-        except Exception as e:
-            print(f"Suggestion error: {e}")
-        finally:
-            reply.deleteLater()
-            self.current_search_reply = None
+    def show_online_suggestions(self, query, suggestions):
+        self.online_suggestions = suggestions
+        self.refresh_completions()
+        self.completer.complete()
 
     def add_new_tab(self, url=None, is_private=False):
         self.suppress_autocomplete = True
@@ -1952,9 +4282,10 @@ class PyBrowse(QtWidgets.QMainWindow):
             qurl = QUrl("https://www.google.com/search?q=" + url)
         
         if is_private:
-            tab = PrivateBrowserTab(qurl.toString(), self.private_profile)
+            tab = PrivateBrowserTab(qurl.toString(), self.private_profile,
+                                    ad_blocker=self.ad_blocker)
         else:
-            tab = BrowserTab(qurl.toString(), self.default_profile)
+            tab = BrowserTab(qurl.toString(), self.default_profile, ad_blocker=self.ad_blocker)
 
         tab_index = self.tabs.addTab(tab, "Loading...")
         tab.titleChanged.connect(self.update_tab_title)
@@ -1967,6 +4298,9 @@ class PyBrowse(QtWidgets.QMainWindow):
         tab.page().loadFinished.connect(
             lambda ok, url=url: self.add_to_history(url)
         )
+        tab.page().loadFinished.connect(
+            lambda ok, tab=tab: self.handle_https_fallback(tab, ok)
+        )
 
     def on_url_changed(self, qurl):
         if not self.suppress_autocomplete:
@@ -2051,6 +4385,7 @@ class PyBrowse(QtWidgets.QMainWindow):
             # The Developer Console (internally known as the Developer Tools) WILL be returning in 0.4.0. Due to the amount of problems it's causing, it's been temporarily deprecated.
             ('dev_tools', 'Developer Console', self.open_dev_tools, 'dev_tools.svg'),
             ('history', 'History', self.open_history_page, 'history.svg'),
+            ('blocker_stats', 'Blocker Stats', self.open_blocker_stats, 'stats.svg'),
             ('reader_mode', 'Reader Mode', self.toggle_reader_mode, 'reader.svg'),
             ('fullscreen', 'Fullscreen', self.toggle_fullscreen, 'fullscreen.svg')
         ]
@@ -2122,18 +4457,16 @@ class PyBrowse(QtWidgets.QMainWindow):
     
         self.completer = QCompleter(self.url_bar)
         self.completer.setCaseSensitivity(Qt.CaseInsensitive)
-        self.completer.setFilterMode(Qt.MatchContains)
+        # the model already holds only matching rows, ranked; filtering them
+        # again would hide word-prefix, title and online matches
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         self.completer.setModel(self.completer_model)
         self.url_bar.setCompleter(self.completer)
         self.url_bar.textChanged.connect(self.handle_text_changes)
     
     def handle_user_typing(self):
         if not self.suppress_autocomplete:
-            self.start_search_timer()
-    
-    def start_search_timer(self):
-        if self.suppress_autocomplete:
-            return
+            self.fetch_search_suggestions()
 
     def url_bar_focused(self, event):
         QtWidgets.QLineEdit.focusInEvent(self.url_bar, event)
@@ -2156,6 +4489,15 @@ class PyBrowse(QtWidgets.QMainWindow):
         download_tab_index = self.tabs.addTab(self.download_manager, "Downloads")
         self.tabs.setCurrentIndex(download_tab_index)
 
+    def open_blocker_stats(self):
+        for i in range(self.tabs.count()):
+            if isinstance(self.tabs.widget(i), BlockerStatsPage):
+                self.tabs.setCurrentIndex(i)
+                return
+        stats_page = BlockerStatsPage(self.ad_blocker, self.interceptors)
+        i = self.tabs.addTab(stats_page, "Blocker Stats")
+        self.tabs.setCurrentIndex(i)
+
 
     def go_forward(self):
         if self.tabs.count() > 0:
@@ -2206,6 +4548,8 @@ class PyBrowse(QtWidgets.QMainWindow):
         settings = QtCore.QSettings("PyBrowse", "PyBrowse")
         self.search_engine = settings.value("search_engine", "Google", str)
         self.custom_search_engine = settings.value("custom_search_engine", "", str)
+        self.suggestion_scheduler.load_settings()
+        self.suggestion_scheduler.set_providers(remote_suggestion_providers(self.search_engine))
 
     def show_about_dialog(self):
         dialog = AboutDialog(self)
@@ -2231,17 +4575,31 @@ class PyBrowse(QtWidgets.QMainWindow):
         if not query:
             return
 
+        fallback = None
         if re.match(r'^https?://', query, re.IGNORECASE):
             url = QtCore.QUrl(query)
         elif '.' in query and ' ' not in query:
-            url = QtCore.QUrl(f"http://{query}")
+            url, fallback = self.https_upgrader.typed_url(query)
         else:
             url = QtCore.QUrl(self.get_search_url(query))
         
         current_tab = self.tabs.currentWidget()
         if isinstance(current_tab, BrowserTab):
+            current_tab.https_fallback_url = fallback
             current_tab.setUrl(url)
-            self.add_to_history(url.toString())
+            self.add_to_history(url.toString(), typed=True)
+
+    def handle_https_fallback(self, tab, ok):
+        fallback = tab.https_fallback_url
+        if fallback is None:
+            return
+        tab.https_fallback_url = None
+        # a load that finished on another host was a new navigation, not
+        # the HTTPS attempt failing
+        if ok or tab.url().host() != fallback.host():
+            return
+        self.https_upgrader.http_only.add(fallback.host().lower())
+        tab.setUrl(fallback)
 
     def get_search_url(self, query):
         if self.search_engine == "Google":
@@ -2285,12 +4643,14 @@ class PyBrowse(QtWidgets.QMainWindow):
 
     def open_history_page(self):
         """Open a new tab with the browsing history."""
-        history_tab = HistoryPage(self.history)
+        history_tab = HistoryPage(self.history_store)
+        history_tab.history_cleared.connect(self.reload_completions)
         i = self.tabs.addTab(history_tab, "History")
         self.tabs.setCurrentIndex(i)
 
-    def add_to_history(self, url):
+    def add_to_history(self, url, typed=False):
         if not self.is_private_mode:
+            url = self.param_stripper.canonical(url)
             current_tab = self.tabs.currentWidget()
             title = ""
             
@@ -2300,17 +4660,12 @@ class PyBrowse(QtWidgets.QMainWindow):
                 title = QUrl(url).host() or url[:50]  # use domain or first 50 chars
             
             # avoid duplicate consecutive entries
-            if not self.history or self.history[-1].get('url') != url:
-                self.history.append({
-                    'url': url,
-                    'title': title,
-                    'timestamp': datetime.now().isoformat()
-                })
-                # trim history if it exceeds limit
-                if len(self.history) > 500:
-                    self.history = self.history[-500:]
-                self.save_history()
-                self.update_completer_model()
+            if self.last_history_url != url:
+                self.last_history_url = url
+                visit_time = time.time()
+                self.persistence.add_visit(url, title, visit_time, typed)
+                self.frecency.add_visit(url, visit_time, typed)
+                self.refresh_completions()
 
     def add_bookmark(self):
         current_tab = self.tabs.currentWidget()
@@ -2324,8 +4679,9 @@ class PyBrowse(QtWidgets.QMainWindow):
             }
             if entry not in self.bookmarks:
                 self.bookmarks.append(entry)
-            self.save_bookmarks()
-            self.update_completer_model()
+                self.persistence.append("bookmarks", {'op': 'add', 'entry': entry})
+                self.frecency.set_bookmarked(self.param_stripper.canonical(url))
+                self.refresh_completions()
 
     def toggle_reader_mode(self):
         current_tab = self.tabs.currentWidget()
@@ -2342,45 +4698,28 @@ class PyBrowse(QtWidgets.QMainWindow):
             bookmark_action.triggered.connect(lambda checked, url=bookmark: self.tabs.currentWidget().setUrl(QtCore.QUrl(url)))
             self.bookmarks_menu.addAction(bookmark_action)
 
-    def save_bookmarks(self):
-        """Save the bookmarks to a JSON file."""
-        with open(self.bookmarks_file, 'w') as f:
-            json.dump(self.bookmarks, f)
-
     def load_bookmarks(self):
+        """Replay the bookmark snapshot and journal."""
         self.bookmarks = []
-        if os.path.exists(self.bookmarks_file):
-            with open(self.bookmarks_file, 'r') as f:
-                bookmarks_data = json.load(f)
-                for entry in bookmarks_data:
-                    if isinstance(entry, str):
-                        self.bookmarks.append({
-                            'url': entry,
-                            'title': entry,
-                            'created': datetime.now().isoformat()
-                        })
-                    else:
-                        self.bookmarks.append(entry)
-
-    def save_history(self):
-        """Save the history to a JSON file."""
-        with open(self.history_file, 'w') as f:
-            json.dump(self.history, f)
+        for entry in self.bookmark_journal.load():
+            if isinstance(entry, str):
+                self.bookmarks.append({
+                    'url': entry,
+                    'title': entry,
+                    'created': datetime.now().isoformat()
+                })
+            else:
+                self.bookmarks.append(entry)
 
     def load_history(self):
-        self.history = []
-        if os.path.exists(self.history_file):
-            with open(self.history_file, 'r') as f:
-                history_data = json.load(f)
-                for entry in history_data:
-                    if isinstance(entry, str):
-                        self.history.append({
-                            'url': entry,
-                            'title': entry,
-                            'timestamp': datetime.now().isoformat()
-                        })
-                    else:
-                        self.history.append(entry)
+        """Bring an old history.json over into the history database."""
+        try:
+            imported = self.history_store.import_json(self.history_file)
+            if imported:
+                print(f"Imported {imported} history entries from {self.history_file}")
+            self.last_history_url = self.history_store.last_url()
+        except sqlite3.Error as e:
+            print(f"Error loading history: {e}")
 
     def keyPressEvent(self, event):
         if event.key() == QtCore.Qt.Key_Escape and self.is_fullscreen:
@@ -2416,6 +4755,8 @@ class PyBrowse(QtWidgets.QMainWindow):
         if hasattr(self, 'download_manager'):
             self.download_manager.close()
             self.download_manager.deleteLater()
+        self.persistence.stop()
+        self.history_store.close()
         event.accept()
 
     def start_cleanup(self):